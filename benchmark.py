@@ -0,0 +1,468 @@
+"""Offline benchmarks for the Cursed Archives pipeline.
+
+Every remote service is replaced by a local stand-in with configurable latency,
+job time and failure rate, so the numbers are reproducible on a machine with no
+network:
+
+    python benchmark.py pipeline --runs 2 --job-time 2 --failure-rate 0.1
+    python benchmark.py pipeline --batch 3
+    python benchmark.py render --images 3,5,8 --durations 10,30,55 --backends moviepy,ffmpeg
+    python benchmark.py render --profiles draft,final --threads 4
+
+Groq, Freepik, Submagic, Creatomate and file.io are served over HTTP by one fake
+server; the gradio Spaces (Wan, Kokoro), EdgeTTS and the YouTube client are
+swapped for in-process fakes because their client libraries speak protocols
+that are not worth re-implementing here.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# --- FIXTURES ---
+def make_fixtures(directory, ffmpeg):
+    """Noise images, a hook clip and a TTS-like audio clip."""
+    import numpy as np
+    import PIL.Image
+
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(0)
+    images = []
+    for i in range(4):
+        # Gradient + noise so the encoder has real detail to chew on
+        grad = np.linspace(0, 255, 1536, dtype=np.float32)[:, None, None]
+        noise = rng.integers(0, 60, size=(1536, 864, 3)).astype(np.float32)
+        arr = np.clip(grad * (0.3 + 0.2 * i) + noise, 0, 255).astype(np.uint8)
+        path = os.path.join(directory, f"image_{i}.jpg")
+        PIL.Image.fromarray(arr).save(path, quality=90)
+        images.append(path)
+
+    video = os.path.join(directory, "hook.mp4")
+    subprocess.run([ffmpeg, "-loglevel", "error", "-y", "-f", "lavfi", "-i", "testsrc2=s=832x480:r=16:d=5",
+                    "-pix_fmt", "yuv420p", video], check=True)
+    audio = make_audio_fixture(directory, ffmpeg, 6.0)
+    return {"images": images, "video": video, "audio": audio}
+
+def make_audio_fixture(directory, ffmpeg, duration):
+    path = os.path.join(directory, f"speech_{duration:g}s.mp3")
+    if not os.path.exists(path):
+        subprocess.run([ffmpeg, "-loglevel", "error", "-y", "-f", "lavfi",
+                        "-i", f"sine=f=180:d={duration}", "-ac", "1", path], check=True)
+    return path
+
+# --- FAKE HTTP SERVICES ---
+class FakeServices:
+    """Groq, Freepik, Submagic, Creatomate and file.io on one local port."""
+
+    def __init__(self, fixtures, latency=0.05, job_time=1.0, failure_rate=0.0, seed=0):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.job_time = job_time
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.jobs = {}
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def env(self):
+        return {
+            "GROQ_BASE_URL": f"{self.url}/groq",
+            "FREEPIK_BASE_URL": f"{self.url}/freepik",
+            "SUBMAGIC_BASE_URL": f"{self.url}/submagic/v1",
+            "CREATOMATE_BASE_URL": f"{self.url}/creatomate/v2/renders",
+            "TEMP_HOST_URL": f"{self.url}/fileio",
+            "POLLINATIONS_BASE_URL": f"{self.url}/pollinations",
+        }
+
+    def _fails(self):
+        with self.lock:
+            return self.rng.random() < self.failure_rate
+
+    def _new_job(self, result):
+        job_id = uuid.uuid4().hex[:12]
+        self.jobs[job_id] = {"ready": time.time() + self.job_time, "failed": self._fails(), "result": result}
+        return job_id
+
+    def _job_state(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        if job["failed"]:
+            return "failed"
+        return "done" if time.time() >= job["ready"] else "running"
+
+    def _handler(self):
+        svc = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, code, body=None, content_type="application/json", raw=None):
+                payload = raw if raw is not None else json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return self.rfile.read(length) if length else b""
+
+            def _route(self, method):
+                time.sleep(svc.latency)
+                path = self.path.split("?")[0]
+                key = f"{method} {'/'.join(path.split('/')[:3])}"
+                with svc.lock:
+                    svc.calls[key] = svc.calls.get(key, 0) + 1
+                body = self._body() if method == "POST" else b""
+
+                # Static fixture downloads
+                if path.startswith("/files/"):
+                    name = os.path.basename(path)
+                    with open(os.path.join(svc.fixtures["dir"], name), "rb") as f:
+                        return self._send(200, raw=f.read(), content_type="application/octet-stream")
+
+                # Space health check (the Spaces themselves are in-process fakes)
+                if path == "/space/config":
+                    return self._send(200, {"version": "fake"})
+
+                if method == "POST" and path.startswith("/groq/"):
+                    return self._groq(json.loads(body or b"{}"))
+
+                # Freepik Mystic
+                if path == "/freepik/v1/ai/mystic" and method == "POST":
+                    if svc._fails():
+                        return self._send(500, {"error": "injected failure"})
+                    image = os.path.basename(svc.rng.choice(svc.fixtures["images"]))
+                    task_id = svc._new_job(f"{svc.url}/files/{image}")
+                    return self._send(200, {"data": {"task_id": task_id, "status": "CREATED"}})
+                if path.startswith("/freepik/v1/ai/mystic/"):
+                    job_id = path.rsplit("/", 1)[1]
+                    state = svc._job_state(job_id)
+                    status = {"done": "COMPLETED", "failed": "FAILED", "running": "IN_PROGRESS"}.get(state)
+                    data = {"task_id": job_id, "status": status}
+                    if state == "done":
+                        data["generated"] = [svc.jobs[job_id]["result"]]
+                    return self._send(200, {"data": data})
+
+                # Submagic
+                if path == "/submagic/v1/projects" and method == "POST":
+                    job_id = svc._new_job(f"{svc.url}/files/{os.path.basename(svc.fixtures['video'])}")
+                    return self._send(201, {"id": job_id, "status": "processing"})
+                if path.startswith("/submagic/v1/projects/"):
+                    job_id = path.rsplit("/", 1)[1]
+                    state = svc._job_state(job_id)
+                    data = {"id": job_id, "status": {"done": "completed", "failed": "failed"}.get(state, "processing")}
+                    if state == "done":
+                        data["videoUrl"] = svc.jobs[job_id]["result"]
+                    return self._send(200, data)
+
+                # Pollinations (backup image provider)
+                if path.startswith("/pollinations/prompt/"):
+                    if svc._fails():
+                        return self._send(500, {"error": "injected failure"})
+                    time.sleep(svc.job_time)
+                    image = svc.rng.choice(svc.fixtures["images"])
+                    with open(image, "rb") as f:
+                        return self._send(200, raw=f.read(), content_type="image/jpeg")
+
+                # file.io + Creatomate
+                if path == "/fileio" and method == "POST":
+                    return self._send(200, {"success": True, "link": f"{svc.url}/files/{os.path.basename(svc.fixtures['video'])}"})
+                if path == "/creatomate/v2/renders" and method == "POST":
+                    job_id = svc._new_job(f"{svc.url}/files/{os.path.basename(svc.fixtures['video'])}")
+                    return self._send(200, [{"id": job_id, "status": "planned"}])
+                if path.startswith("/creatomate/v2/renders/"):
+                    job_id = path.rsplit("/", 1)[1]
+                    state = svc._job_state(job_id)
+                    data = {"id": job_id, "status": {"done": "succeeded", "failed": "failed"}.get(state, "rendering")}
+                    if state == "done":
+                        data["url"] = svc.jobs[job_id]["result"]
+                    return self._send(200, data)
+
+                return self._send(404, {"error": f"no fake for {method} {path}"})
+
+            def _groq(self, request):
+                user = request["messages"][-1]["content"]
+                words = [w for w in user.split() if w.isdigit()]
+                count = int(words[0]) if words else 1
+                concepts = [fake_concept(i) for i in range(count)]
+                content = concepts[0] if count == 1 else {"concepts": concepts}
+                return self._send(200, {
+                    "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()),
+                    "model": request.get("model", "fake"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": json.dumps(content)}}],
+                    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+                })
+
+            def do_GET(self):
+                self._route("GET")
+
+            def do_POST(self):
+                self._route("POST")
+
+        return Handler
+
+PLACES = ["hallway", "basement", "motel", "school", "forest", "mall", "hospital", "subway", "attic", "lake"]
+THINGS = ["shadow", "voice", "doll", "door", "signal", "mirror", "figure", "camera", "song", "phone"]
+
+def fake_concept(i):
+    # Distinct titles and hooks, so the concept pool doesn't drop them as duplicates
+    place, thing = random.choice(PLACES), random.choice(THINGS)
+    tag = uuid.uuid4().hex
+    return {
+        "title": f"The {thing} in the {place} (tape {tag})",
+        "target_reaction": "CURSED",
+        "hook_visual": f"a flickering {place}",
+        "hook_audio": f"Nobody was supposed to record the {thing} in {place} {tag}.",
+        "hook_text": "DON'T WATCH ALONE",
+        "script_body": " ".join(["The lights went out and something moved behind the door."] * 6),
+        "visual_prompts": [f"found footage frame {n}" for n in range(4)],
+        "description": "benchmark",
+        "hashtags": "#bench #shorts",
+    }
+
+# --- IN-PROCESS FAKES (gradio Spaces, EdgeTTS, YouTube) ---
+def install_in_process_fakes(main, fixtures, latency, failure_rate, seed=0, space_url=None):
+    from concurrent.futures import ThreadPoolExecutor
+    rng = random.Random(seed)
+    lock = threading.Lock()
+    _space_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="fake-space")
+
+    def maybe_fail(what):
+        with lock:
+            if rng.random() < failure_rate:
+                raise RuntimeError(f"injected {what} failure")
+
+    class FakeGradioClient:
+        def __init__(self, src, *args, **kwargs):
+            time.sleep(latency)  # Space config fetch
+            self.space = src
+            self.src = space_url or src
+
+        def predict(self, *args, api_name=None, **kwargs):
+            time.sleep(latency)
+            maybe_fail(api_name)
+            if api_name == "/generate_video":
+                return (fixtures["video"], fixtures["video"], 42)
+            return fixtures["audio"]
+
+        def submit(self, *args, **kwargs):
+            return FakeJob(_space_pool.submit(self.predict, *args, **kwargs))
+
+    class FakeJob:
+        def __init__(self, future):
+            self.future = future
+
+        def done(self):
+            return self.future.done()
+
+        def cancel(self):
+            return self.future.cancel()
+
+        def result(self):
+            return self.future.result()
+
+    class FakeCommunicate:
+        def __init__(self, text, voice, *args, **kwargs):
+            self.text = text
+
+        async def save(self, filename):
+            import asyncio
+            await asyncio.sleep(latency)
+            maybe_fail("edge tts")
+            shutil.copy(fixtures["audio"], filename)
+
+        async def stream(self):
+            """Fixture audio in chunks, with a WordBoundary event every 0.3s."""
+            import asyncio
+            await asyncio.sleep(latency)
+            maybe_fail("edge tts")
+            for i, word in enumerate(self.text.split()):
+                yield {"type": "WordBoundary", "offset": int(i * 0.3e7), "duration": int(0.25e7), "text": word}
+            with open(fixtures["audio"], "rb") as f:
+                for data in iter(lambda: f.read(64 * 1024), b""):
+                    yield {"type": "audio", "data": data}
+
+    class FakeYouTube:
+        """Mimics a resumable insert: next_chunk() returns (status, None) per chunk, then (None, response)."""
+
+        def videos(self):
+            return self
+
+        def insert(self, media_body=None, **kwargs):
+            self.media = media_body
+            self.offset = 0
+            return self
+
+        def next_chunk(self):
+            time.sleep(latency)
+            maybe_fail("youtube upload")
+            size = self.media.size()
+            self.offset = min(size, self.offset + self.media.chunksize())
+            if self.offset < size:
+                return FakeStatus(self.offset, size), None
+            return None, {"id": "bench" + uuid.uuid4().hex[:6]}
+
+    class FakeStatus:
+        def __init__(self, progress, total):
+            self.resumable_progress = progress
+            self.total_size = total
+
+        def progress(self):
+            return self.resumable_progress / self.total_size
+
+    import edge_tts # main imports it lazily, at call time
+    main.Client = FakeGradioClient
+    edge_tts.Communicate = FakeCommunicate
+    main.youtube_client = lambda creds: FakeYouTube()
+
+# --- BENCHMARKS ---
+def load_main(env):
+    os.environ.update(env)
+    sys.argv = sys.argv[:1]
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main
+    return main
+
+def bench_pipeline(args, workdir):
+    fixtures_dir = os.path.join(workdir, "fixtures")
+    env = {
+        "RUNS_DIR": os.path.join(workdir, "runs"),
+        "ASSET_CACHE_DIR": os.path.join(workdir, "cache"),
+        "ASSET_CACHE": "1" if args.cache else "0",
+        "GROQ_API_KEY": "bench", "FREEPIK_API_KEY": "bench",
+        "SUBMAGIC_API_KEY": "bench", "CREATOMATE_API_KEY": "bench",
+        "RENDER_BACKEND": args.backend,
+        "TTS_ENGINE": args.tts_engine,
+    }
+    main = load_main(env)
+    fixtures = make_fixtures(fixtures_dir, main.ffmpeg_bin())
+    fixtures["dir"] = fixtures_dir
+
+    services = FakeServices(fixtures, args.latency, args.job_time, args.failure_rate, args.seed).start()
+    os.environ.update(services.env())
+    # Module-level endpoint constants were read at import; point them at the fakes too
+    main.FREEPIK_BASE_URL = os.environ["FREEPIK_BASE_URL"]
+    main.TEMP_HOST_URL = os.environ["TEMP_HOST_URL"]
+    main.POLLINATIONS_BASE_URL = os.environ["POLLINATIONS_BASE_URL"]
+    main.SubmagicClient.BASE_URL = os.environ["SUBMAGIC_BASE_URL"]
+    main.CreatomateClient.BASE_URL = os.environ["CREATOMATE_BASE_URL"]
+    install_in_process_fakes(main, fixtures, args.latency, args.failure_rate, args.seed, space_url=f"{services.url}/space/")
+
+    results = []
+    try:
+        for i in range(args.runs):
+            start = time.time()
+            if args.batch:
+                out = main.run_batch(args.batch)
+                ok = sum(1 for v in out.values() if v)
+            else:
+                run = main.PipelineRun()
+                try:
+                    main.run_pipeline(run)
+                    run.finish()
+                    ok = 1
+                except Exception as e:
+                    print(f"❌ Run failed: {e}")
+                    run.finish(error=e)
+                    ok = 0
+            results.append({"run": i, "wall_s": round(time.time() - start, 2), "published": ok})
+            print(f"⏱️ Run {i}: {results[-1]['wall_s']}s ({ok} published)")
+    finally:
+        services.stop()
+
+    print(main.tracer.report())
+    print(main.asset_cache.report())
+    return {"mode": "pipeline", "runs": results, "summary": main.tracer.summary(), "calls": services.calls}
+
+def bench_render(args, workdir):
+    main = load_main({"RUNS_DIR": os.path.join(workdir, "runs"), "ASSET_CACHE": "0"})
+    fixtures = make_fixtures(os.path.join(workdir, "fixtures"), main.ffmpeg_bin())
+    hook_audio = make_audio_fixture(workdir, main.ffmpeg_bin(), 3.0)
+
+    main.ENCODE_THREADS = args.threads
+
+    results = []
+    for backend in args.backends.split(","):
+        for profile in args.profiles.split(","):
+            for n_images in [int(n) for n in args.images.split(",")]:
+                for duration in [float(d) for d in args.durations.split(",")]:
+                    body_audio = make_audio_fixture(workdir, main.ffmpeg_bin(), duration)
+                    images = [fixtures["images"][i % len(fixtures["images"])] for i in range(n_images)]
+                    out = os.path.join(workdir, f"render_{backend}_{profile}_{n_images}_{duration:g}.mp4")
+                    random.seed(args.seed)
+                    start = time.time()
+                    main.create_viral_short(fixtures["video"], images, hook_audio, body_audio, "WAIT FOR IT", out,
+                                            backend=backend, workers=args.workers, profile=profile)
+                    wall = time.time() - start
+                    video_s = main.probe_duration(out)
+                    row = {"backend": backend, "profile": profile, "images": n_images, "body_s": duration,
+                           "workers": args.workers, "threads": args.threads, "wall_s": round(wall, 2),
+                           "video_s": round(video_s, 2), "realtime_x": round(video_s / wall, 2),
+                           "encode_fps": round(video_s * main.FPS / wall, 1), "size_mb": round(os.path.getsize(out) / 1e6, 2)}
+                    results.append(row)
+                    print(f"🎞️ {backend:<8} {profile:<6} images={n_images:<2} body={duration:>5.1f}s -> {wall:6.2f}s "
+                          f"({row['encode_fps']} fps, {row['realtime_x']}x realtime, {row['size_mb']} MB)")
+    return {"mode": "render", "results": results}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline Cursed Archives benchmarks")
+    sub = parser.add_subparsers(dest="mode", required=True)
+
+    p = sub.add_parser("pipeline", help="Full __main__ flow against local fakes")
+    p.add_argument("--runs", type=int, default=1)
+    p.add_argument("--batch", type=int, default=0, help="Use batch mode with N videos per run")
+    p.add_argument("--latency", type=float, default=0.05, help="Seconds added to every fake request")
+    p.add_argument("--job-time", type=float, default=1.0, help="Seconds a fake remote job takes to finish")
+    p.add_argument("--failure-rate", type=float, default=0.0)
+    p.add_argument("--cache", action="store_true", help="Keep the asset cache enabled")
+    p.add_argument("--backend", default="moviepy")
+    p.add_argument("--tts-engine", default="remote", help="'local' runs the real Kokoro ONNX model (needs kokoro-onnx + model files)")
+
+    r = sub.add_parser("render", help="Microbenchmark create_viral_short")
+    r.add_argument("--images", default="3,5")
+    r.add_argument("--durations", default="10,30")
+    r.add_argument("--backends", default="moviepy,ffmpeg")
+    r.add_argument("--workers", type=int, default=1)
+    r.add_argument("--profiles", default="draft,final", help="Encode profiles to compare")
+    r.add_argument("--threads", type=int, default=0, help="x264 threads (0 = automatic)")
+
+    for sp in (p, r):
+        sp.add_argument("--seed", type=int, default=0)
+        sp.add_argument("--out", help="Write results as JSON")
+        sp.add_argument("--keep", action="store_true", help="Keep the temporary work directory")
+
+    args = parser.parse_args()
+    workdir = tempfile.mkdtemp(prefix="cursed-bench-")
+    try:
+        result = bench_pipeline(args, workdir) if args.mode == "pipeline" else bench_render(args, workdir)
+        if args.out:
+            with open(args.out, "w") as f:
+                json.dump(result, f, indent=2, default=str)
+            print(f"📄 Results written to {args.out}")
+    finally:
+        if args.keep:
+            print(f"📁 Work dir kept: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
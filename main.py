@@ -1,24 +1,45 @@
+import time
+_IMPORT_START = time.perf_counter()
 import os
+import re
 import random
 import requests
 import asyncio
-import edge_tts
-import time
 import json
 import shutil
+import hashlib
+import math
+import resource
+import functools
+import contextlib
+import itertools
+import atexit
+import multiprocessing
+import argparse
+import subprocess
+import sqlite3
 import urllib.parse
-from gradio_client import Client
-from groq import Groq
+import threading
+import bisect
+import glob
+import difflib
+import email.utils
+import importlib
+import sys
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import PIL.Image
+import PIL.ImageDraw
+import PIL.ImageFont
+import numpy as np
 
 # --- 🛠️ COMPATIBILITY FIX ---
 if not hasattr(PIL.Image, 'ANTIALIAS'):
     PIL.Image.ANTIALIAS = PIL.Image.LANCZOS
 
-from moviepy.editor import *
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+# moviepy, gradio_client, groq, edge_tts and the Google client are imported inside the
+# stages that use them, so dry runs, resumed uploads and tooling start without loading them.
 
 # --- CONFIGURATION ---
 def get_secret(key):
@@ -31,6 +52,564 @@ YT_CLIENT_SECRET = get_secret("YOUTUBE_CLIENT_SECRET")
 YT_REFRESH_TOKEN = get_secret("YOUTUBE_REFRESH_TOKEN")
 HF_TOKEN = get_secret("HF_TOKEN") 
 
+# Endpoints (overridable so the benchmark can point them at local stand-ins)
+FREEPIK_BASE_URL = os.environ.get("FREEPIK_BASE_URL", "https://api.freepik.com")
+TEMP_HOST_URL = os.environ.get("TEMP_HOST_URL", "https://file.io")
+WAN_SPACE = os.environ.get("WAN_SPACE", "r3gm/wan2-2-fp8da-aoti-preview2")
+KOKORO_SPACE = os.environ.get("KOKORO_SPACE", "https://yakhyo-kokoro-onnx.hf.space/")
+
+# --- 0. HTTP LAYER (Pooled Session + Job Polling) ---
+# (connect, read) timeouts. Uploads get a longer read window.
+HTTP_TIMEOUT = (10, 60)
+UPLOAD_TIMEOUT = (10, 600)
+
+_http_session = None
+_http_lock = threading.Lock()
+
+def get_http():
+    """Process-wide keep-alive session shared by every remote API client.
+    Connection-level failures and 502/503/504 on GETs are retried by urllib3."""
+    global _http_session
+    with _http_lock:
+        if _http_session is None:
+            retry = Retry(
+                total=3, connect=3, backoff_factor=0.5,
+                status_forcelist=[502, 503, 504],
+                allowed_methods=["GET", "HEAD"],
+                respect_retry_after_header=True,
+            )
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=retry)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _http_session = session
+    return _http_session
+
+class JobFailed(Exception):
+    """A remote job reached a terminal failure state."""
+
+class Cancelled(Exception):
+    """A hedged attempt lost the race and stopped early."""
+
+def retry_after(res):
+    """Seconds the server asked us to wait (Retry-After or rate-limit reset headers), or None."""
+    if res is None:
+        return None
+    value = res.headers.get("Retry-After")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                when = email.utils.parsedate_to_datetime(value)
+                return max(0.0, when.timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+
+    remaining = res.headers.get("X-RateLimit-Remaining") or res.headers.get("RateLimit-Remaining")
+    reset = res.headers.get("X-RateLimit-Reset") or res.headers.get("RateLimit-Reset")
+    if remaining is not None and reset and remaining.strip() == "0":
+        try:
+            reset = float(reset)
+        except ValueError:
+            return None
+        # Either an epoch timestamp or a delta in seconds
+        return max(0.0, reset - time.time()) if reset > 1e9 else reset
+    return None
+
+def poll_job(fetch, check, label="Job", base_delay=2.0, max_delay=30.0, timeout=600, jitter=0.25, cancel=None):
+    """Poll a remote job until it reaches a terminal state.
+
+    fetch() -> requests.Response for the job status endpoint.
+    check(json) -> result when done, None while still running; raises JobFailed on failure.
+
+    Waits grow exponentially (with jitter) from base_delay up to max_delay, and any
+    Retry-After / rate-limit reset the server sends takes precedence. Setting the
+    optional `cancel` event stops polling with Cancelled.
+    """
+    delay = base_delay
+    deadline = time.monotonic() + timeout
+    res = None
+
+    while True:
+        wait_s = delay * random.uniform(1 - jitter, 1 + jitter)
+        hint = retry_after(res)
+        if hint is not None:
+            wait_s = max(wait_s, hint)
+        if time.monotonic() + wait_s > deadline:
+            raise TimeoutError(f"{label} did not finish within {timeout}s")
+        if cancel is not None:
+            if cancel.wait(wait_s):
+                raise Cancelled(f"{label} cancelled")
+        else:
+            time.sleep(wait_s)
+        delay = min(delay * 2, max_delay)
+
+        tracer.count("polls")
+        try:
+            res = fetch()
+        except requests.RequestException as e:
+            print(f"   {label} Polling Error: {e}")
+            res = None
+            continue
+
+        if res.status_code == 200:
+            result = check(res.json())
+            if result is not None:
+                return result
+        else:
+            print(f"   {label} Polling Error: {res.status_code}")
+
+DOWNLOAD_CHUNK = 256 * 1024 # Small enough that a dropped connection loses little
+
+def _total_size(res, offset):
+    """Full size of the remote file from Content-Range (206) or Content-Length (200), if known."""
+    content_range = res.headers.get("Content-Range", "")
+    if "/" in content_range and not content_range.endswith("/*"):
+        return int(content_range.rsplit("/", 1)[1])
+    length = res.headers.get("Content-Length")
+    return offset + int(length) if length else None
+
+def download_file(url, path, max_attempts=5):
+    """Stream url to disk chunk by chunk. A dropped connection resumes with a Range
+    request from the last byte written instead of starting over."""
+    http = get_http()
+    part = path + ".part"
+    offset = 0
+    if os.path.exists(part):
+        os.remove(part)
+
+    for attempt in range(max_attempts):
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        try:
+            with http.get(url, headers=headers, stream=True, timeout=HTTP_TIMEOUT) as res:
+                if res.status_code == 416 and offset:
+                    break # Already have every byte
+                res.raise_for_status()
+                if offset and res.status_code != 206:
+                    offset = 0 # Server ignored the Range header; start again
+                total = _total_size(res, offset)
+
+                with open(part, "ab" if offset else "wb") as f:
+                    for chunk in res.iter_content(DOWNLOAD_CHUNK):
+                        f.write(chunk)
+                        offset += len(chunk)
+                        tracer.count("bytes_in", len(chunk))
+
+                if total is not None and offset < total:
+                    raise IOError(f"connection closed at {offset}/{total} bytes")
+            break
+        except (requests.RequestException, IOError) as e:
+            if attempt == max_attempts - 1:
+                raise
+            print(f"   ⚠️ Download interrupted ({e}). Resuming from byte {offset}...")
+            tracer.count("retries")
+            time.sleep(min(2 ** attempt, 10))
+
+    os.replace(part, path)
+    return path
+
+class MultipartFile:
+    """multipart/form-data body of one file plus plain fields, read from disk as it is sent;
+    requests' files= builds the whole body in memory first. Pass it as data= with
+    headers={"Content-Type": body.content_type}. It has a length, so requests sends a
+    Content-Length rather than chunking, and it can be iterated again on a resend."""
+
+    def __init__(self, path, field="file", fields=None, content_type="application/octet-stream"):
+        self.path = path
+        boundary = os.urandom(16).hex()
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        name = os.path.basename(path).replace('"', "")
+        parts = [f'--{boundary}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n' for k, v in (fields or {}).items()]
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{name}"\r\n'
+                     f'Content-Type: {content_type}\r\n\r\n')
+        self._head = "".join(parts).encode("utf-8")
+        self._tail = f"\r\n--{boundary}--\r\n".encode("ascii")
+
+    def __len__(self):
+        return len(self._head) + os.path.getsize(self.path) + len(self._tail)
+
+    def __iter__(self):
+        yield self._head
+        with open(self.path, "rb") as f:
+            for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK), b""):
+                yield chunk
+        yield self._tail
+
+# --- 0.2. HEDGING (Provider Racing) ---
+def hedge_budget(key, default):
+    """Seconds before a backup provider is started: 0 races immediately,
+    'off' only starts the backup once the primary has failed."""
+    value = os.environ.get(key, default).strip().lower()
+    return None if value in ("off", "none", "") else float(value)
+
+TTS_HEDGE_AFTER = hedge_budget("TTS_HEDGE_AFTER", "10")
+IMAGE_HEDGE_AFTER = hedge_budget("IMAGE_HEDGE_AFTER", "20")
+
+_hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="hedge")
+
+def hedged_to_file(label, providers, filename, hedge_after):
+    """Produce `filename` with the first provider that succeeds.
+
+    providers is a list of (name, fn) where fn(path, cancel_event) writes its result
+    to path. The first provider starts right away; the next one starts when
+    hedge_after seconds pass without a winner, or as soon as everything running has
+    failed. Each attempt writes to its own temp file; the winner's is moved into
+    place and the losers get their cancel event set. Returns the winning name.
+    """
+    root, ext = os.path.splitext(filename)
+    running = {}
+    errors = []
+    next_i = 0
+
+    def launch():
+        nonlocal next_i
+        name, fn = providers[next_i]
+        next_i += 1
+        tmp = f"{root}.{name.lower()}{ext}"
+        cancel = threading.Event()
+
+        def attempt():
+            with tracer.span(f"{label.lower()}:{name.lower()}"):
+                fn(tmp, cancel)
+            if cancel.is_set():
+                # Lost the race but finished anyway; don't leave the file behind
+                if os.path.exists(tmp): os.remove(tmp)
+                raise Cancelled(name)
+            return tmp
+
+        running[_hedge_pool.submit(attempt)] = (name, cancel)
+
+    launch()
+    while running:
+        budget = hedge_after if next_i < len(providers) else None
+        done, _ = wait(running, timeout=budget, return_when=FIRST_COMPLETED)
+        if not done:
+            print(f"   ⏱️ {label}: no result after {hedge_after:g}s, hedging with {providers[next_i][0]}...")
+            tracer.count("hedges")
+            launch()
+            continue
+
+        for fut in done:
+            name, _ = running.pop(fut)
+            try:
+                tmp = fut.result()
+            except Exception as e:
+                print(f"   ⚠️ {label} via {name} failed: {e}")
+                errors.append(f"{name}: {e}")
+                continue
+            for _, cancel in running.values():
+                cancel.set()
+            os.replace(tmp, filename)
+            return name
+
+        if not running and next_i < len(providers):
+            launch()
+
+    raise RuntimeError(f"All {label} providers failed ({'; '.join(errors)})")
+
+# --- 0.3. SPACES (Warm gradio Client Pool) ---
+Client = None  # gradio_client.Client, imported on first connect
+
+class SpacePool:
+    """Process-wide gradio Clients, one per Space. Connecting fetches the Space
+    config (and wakes a sleeping Space), so it is done once, ahead of time where
+    possible, and the Client is reused across calls, runs and batch jobs."""
+
+    def __init__(self):
+        self._clients = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _space_lock(self, space):
+        with self._lock:
+            return self._locks.setdefault(space, threading.Lock())
+
+    def get(self, space):
+        global Client
+        if Client is None:
+            from gradio_client import Client
+        with self._space_lock(space):
+            client = self._clients.get(space)
+            if client is None:
+                start = time.time()
+                with tracer.span("space.connect", space=space):
+                    client = Client(space)
+                print(f"   🔌 Connected to Space {space} ({time.time() - start:.1f}s)")
+                self._clients[space] = client
+            return client
+
+    def invalidate(self, space):
+        """Forget a Client after an error so the next get() reconnects."""
+        with self._space_lock(space):
+            self._clients.pop(space, None)
+
+    def healthy(self, space):
+        client = self._clients.get(space)
+        if client is None:
+            return False
+        try:
+            res = get_http().get(urllib.parse.urljoin(client.src, "config"), timeout=HTTP_TIMEOUT)
+            return res.status_code == 200
+        except requests.RequestException:
+            return False
+
+    def prewarm(self, *spaces):
+        """Connect to (and health-check) the given Spaces in the background."""
+        def warm(space):
+            try:
+                self.get(space)
+                if not self.healthy(space):
+                    print(f"   ⚠️ Space {space} failed its health check. Reconnecting on first use.")
+                    self.invalidate(space)
+            except Exception as e:
+                print(f"   ⚠️ Prewarm of {space} failed: {e}")
+        return [_job_pool.submit(warm, space) for space in spaces]
+
+spaces = SpacePool()
+
+_job_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="remote-job")
+
+# --- 0.1. TRACING (Per-Stage Timing) ---
+TRACE_RSS_INTERVAL = 0.05 # Seconds between RSS samples while any span is open
+
+def current_rss_mb():
+    """Resident set size right now (Linux). Elsewhere: the process-lifetime peak."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+class Tracer:
+    """Records one span per traced call: wall time, CPU time on the calling thread
+    (work) vs. the rest (waiting on the network / subprocesses), child-process CPU,
+    RSS at the start and its sampled peak while the span was open, and counters such as
+    retries and bytes transferred. RSS is process-wide, so spans that overlap see each
+    other's memory; rss_growth_mb (peak minus start) is what to compare across stages."""
+
+    def __init__(self):
+        self.spans = []
+        self.t0 = time.time()
+        self._lock = threading.Lock()
+        self._spans_open = threading.Condition(self._lock) # Wakes the RSS sampler
+        self._local = threading.local()
+        self._open = []
+        self._sampler_pid = None
+
+    def _sample_rss(self):
+        while True:
+            with self._spans_open:
+                # Idle (e.g. between drained jobs) costs nothing: block until a span opens
+                self._spans_open.wait_for(lambda: self._open)
+            time.sleep(TRACE_RSS_INTERVAL)
+            rss = current_rss_mb()
+            with self._lock:
+                for span in self._open:
+                    span["_peak_rss"] = max(span["_peak_rss"], rss)
+
+    def _watch_rss(self, span):
+        rss = current_rss_mb()
+        span["_start_rss"] = span["_peak_rss"] = rss
+        with self._lock:
+            self._open.append(span)
+            self._spans_open.notify()
+            # One sampler per process (a forked render worker starts its own)
+            if self._sampler_pid != os.getpid():
+                self._sampler_pid = os.getpid()
+                threading.Thread(target=self._sample_rss, name="trace-rss", daemon=True).start()
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextlib.contextmanager
+    def span(self, name, **attrs):
+        span = {"name": name, "thread": threading.current_thread().name, "tid": threading.get_ident(),
+                "attrs": attrs, "counters": {}, "status": "ok"}
+        start_wall = time.time()
+        start_cpu = time.thread_time()
+        start_child = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self._watch_rss(span)
+        stack = self._stack()
+        stack.append(span)
+        try:
+            yield span
+        except BaseException as e:
+            span["status"] = f"error: {e}"
+            raise
+        finally:
+            stack.pop()
+            end_rss = current_rss_mb()
+            with self._lock:
+                self._open.remove(span)
+            start_rss = span.pop("_start_rss")
+            peak_rss = max(span.pop("_peak_rss"), end_rss)
+            end_child = resource.getrusage(resource.RUSAGE_CHILDREN)
+            wall = time.time() - start_wall
+            work = time.thread_time() - start_cpu
+            span.update({
+                "start": start_wall - self.t0,
+                "wall_s": round(wall, 3),
+                "work_s": round(work, 3),
+                "wait_s": round(max(0.0, wall - work), 3),
+                "child_cpu_s": round((end_child.ru_utime + end_child.ru_stime) - (start_child.ru_utime + start_child.ru_stime), 3),
+                "rss_start_mb": round(start_rss, 1),
+                "peak_rss_mb": round(peak_rss, 1),
+                "rss_growth_mb": round(peak_rss - start_rss, 1),
+            })
+            with self._lock:
+                self.spans.append(span)
+
+    def count(self, key, n=1):
+        """Add to a counter on every span open on this thread (e.g. retries, bytes_in)."""
+        for span in self._stack():
+            span["counters"][key] = span["counters"].get(key, 0) + n
+
+    def traced(self, name):
+        def decorator(fn):
+            if asyncio.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def async_wrapper(*args, **kwargs):
+                    with self.span(name):
+                        return await fn(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def summary(self):
+        totals = {}
+        for span in self.spans:
+            t = totals.setdefault(span["name"], {"calls": 0, "wall_s": 0.0, "work_s": 0.0, "wait_s": 0.0, "counters": {}})
+            t["calls"] += 1
+            for k in ("wall_s", "work_s", "wait_s"):
+                t[k] = round(t[k] + span[k], 3)
+            for k, v in span["counters"].items():
+                t["counters"][k] = t["counters"].get(k, 0) + v
+        return totals
+
+    def write(self, directory, prefix="trace"):
+        """Writes <prefix>.json (spans + per-stage summary) and <prefix>.chrome.json (chrome://tracing / Perfetto)."""
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            spans = list(self.spans)
+        report = {"started": self.t0, "spans": spans, "summary": self.summary()}
+        with open(os.path.join(directory, f"{prefix}.json"), "w") as f:
+            json.dump(report, f, indent=2, default=str)
+
+        events = [{
+            "name": s["name"], "ph": "X", "pid": os.getpid(), "tid": s["tid"],
+            "ts": int(s["start"] * 1e6), "dur": int(s["wall_s"] * 1e6),
+            "args": dict(s["attrs"], **s["counters"], work_s=s["work_s"], wait_s=s["wait_s"],
+                         peak_rss_mb=s["peak_rss_mb"], rss_growth_mb=s["rss_growth_mb"], status=s["status"]),
+        } for s in spans]
+        with open(os.path.join(directory, f"{prefix}.chrome.json"), "w") as f:
+            json.dump({"traceEvents": events}, f, default=str)
+
+    def report(self):
+        lines = ["⏱️ Stage Timings:"]
+        for name, t in sorted(self.summary().items(), key=lambda kv: -kv[1]["wall_s"]):
+            extra = " ".join(f"{k}={v}" for k, v in t["counters"].items())
+            lines.append(f"   {name:<24} x{t['calls']:<3} wall={t['wall_s']:>7.1f}s work={t['work_s']:>6.1f}s wait={t['wait_s']:>7.1f}s {extra}")
+        return "\n".join(lines)
+
+tracer = Tracer()
+
+# --- 0.5. ASSET CACHE (Content-Addressed) ---
+CACHE_DIR = os.environ.get("ASSET_CACHE_DIR", ".asset_cache")
+CACHE_MAX_MB = int(os.environ.get("ASSET_CACHE_MAX_MB", "2048"))
+
+class AssetCache:
+    """Disk cache for generated media, keyed by a hash of (provider, model, prompt, params).
+    Least-recently-used entries are evicted once the cache grows past max_bytes."""
+
+    def __init__(self, root=CACHE_DIR, max_bytes=CACHE_MAX_MB * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.enabled = os.environ.get("ASSET_CACHE", "1") != "0"
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(provider, model, prompt, **params):
+        blob = json.dumps([provider, model, prompt, params], sort_keys=True, default=str)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def file_digest(path):
+        """Content hash of an input file, for keys that depend on another asset (e.g. I2V)."""
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def _path(self, key, ext):
+        return os.path.join(self.root, key[:2], key + ext)
+
+    def fetch(self, key, dest):
+        """Copy a cached asset to dest. Returns True on a hit."""
+        if not self.enabled:
+            return False
+        path = self._path(key, os.path.splitext(dest)[1])
+        if not os.path.exists(path):
+            with self._lock:
+                self.misses += 1
+            return False
+        shutil.copy(path, dest)
+        os.utime(path)  # mtime doubles as the LRU clock
+        with self._lock:
+            self.hits += 1
+        tracer.count("cache_hits")
+        return True
+
+    def store(self, key, src):
+        if not self.enabled or not src or not os.path.exists(src):
+            return
+        path = self._path(key, os.path.splitext(src)[1])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        shutil.copy(src, tmp)
+        os.replace(tmp, path)
+        with self._lock:
+            self.stores += 1
+        self.evict()
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            for dirpath, _, files in os.walk(self.root):
+                for name in files:
+                    if name.endswith(".tmp"):
+                        continue
+                    p = os.path.join(dirpath, name)
+                    st = os.stat(p)
+                    entries.append((st.st_mtime, st.st_size, p))
+            total = sum(size for _, size, _ in entries)
+            for _, size, p in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                os.remove(p)
+                total -= size
+                self.evictions += 1
+
+    def report(self):
+        lookups = self.hits + self.misses
+        rate = (100.0 * self.hits / lookups) if lookups else 0.0
+        return (f"♻️ Asset Cache: {self.hits} hits / {self.misses} misses ({rate:.0f}%), "
+                f"{self.stores} stored, {self.evictions} evicted")
+
+asset_cache = AssetCache()
+
 # --- 1. BRAIN ---
 # --- 1. VIRAL BRAIN ---
 class ViralBrain:
@@ -41,58 +620,262 @@ class ViralBrain:
     ]
 
     def __init__(self, groq_key):
+        from groq import Groq
         self.client = Groq(api_key=groq_key)
 
-    def generate_viral_concept(self):
-        reaction = random.choice(self.REACTIONS)
-        fmt = random.choice(self.FORMATS)
-        print(f"🧠 Brain Active: Target Reaction={reaction} | Format={fmt}")
+    CONCEPT_FIELDS = (
+        "- 'title': Viral clickbait title.\n"
+        "- 'target_reaction': The chosen reaction.\n"
+        "- 'hook_visual': Detailed prompt for the FIRST 3 seconds (The Hook Image).\n"
+        "- 'hook_audio': The first sentence spoken (The Verbal Hook).\n"
+        "- 'hook_text': The text overlay for the hook (The Text Hook).\n"
+        "- 'script_body': The rest of the script (excluding the hook).\n"
+        "- 'visual_prompts': A list of 3-5 highly detailed image prompts for the rest of the video. strictly visual descriptions.\n"
+        "- 'description': Video description.\n"
+        "- 'hashtags': String of hashtags."
+    )
+
+    # Identical for every call, so the provider can reuse the cached prompt prefix;
+    # everything that varies goes in the user message.
+    SYSTEM_PROMPT = (
+        "You are a VIRAL SHORTS ENGINEER. Your goal is to generate a script that escapes 'Swipe Jail'.\n"
+        "MANDATORY RULES:\n"
+        "1. TRIPLE HOOK (0-3s): Visual (weird/scary), Verbal (provocative statement), Text (amplified curiosity).\n"
+        "2. PACING: Fast cuts, no filler. Every sentence must build tension.\n"
+        "3. ENDING: Twist or jump scare or unsettling realization.\n"
+        "4. Write one COMPLETELY DIFFERENT concept per assignment in the user message, using its TARGET EMOTION and FORMAT.\n"
+        "5. DURATION: 20-30 seconds max each.\n\n"
+        "Return JSON of the form {\"concepts\": [...]} where every concept has:\n"
+    ) + CONCEPT_FIELDS
 
-        sys_prompt = (
-            "You are a VIRAL SHORTS ENGINEER. Your goal is to generate a script that escapes 'Swipe Jail'.\n"
-            "MANDATORY RULES:\n"
-            "1. TRIPLE HOOK (0-3s): Visual (weird/scary), Verbal (provocative statement), Text (amplified curiosity).\n"
-            "2. PACING: Fast cuts, no filler. Every sentence must build tension.\n"
-            "3. ENDING: Twist or jump scare or unsettling realization.\n"
-            f"4. TARGET EMOTION: {reaction}.\n"
-            f"5. FORMAT: {fmt}.\n"
-            "6. DURATION: 20-30 seconds max.\n\n"
-            "Return JSON with:\n"
-            "- 'title': Viral clickbait title.\n"
-            "- 'target_reaction': The chosen reaction.\n"
-            "- 'hook_visual': Detailed prompt for the FIRST 3 seconds (The Hook Image).\n"
-            "- 'hook_audio': The first sentence spoken (The Verbal Hook).\n"
-            "- 'hook_text': The text overlay for the hook (The Text Hook).\n"
-            "- 'script_body': The rest of the script (excluding the hook).\n"
-            "- 'visual_prompts': A list of 3-5 highly detailed image prompts for the rest of the video. strictly visual descriptions.\n"
-            "- 'description': Video description.\n"
-            "- 'hashtags': String of hashtags."
+    def _user_message(self, targets, avoid=()):
+        msg = f"Generate {len(targets)} Cursed Archive viral short concepts.\n" + "".join(
+            f"- Concept {i+1}: TARGET EMOTION={reaction}, FORMAT={fmt}\n" for i, (reaction, fmt) in enumerate(targets)
         )
+        if avoid:
+            msg += "Do not repeat these recent titles:\n" + "".join(f"- {t}\n" for t in avoid)
+        return msg
 
+    def _complete(self, user_msg):
         completion = self.client.chat.completions.create(
             messages=[
-                {"role": "system", "content": sys_prompt},
-                {"role": "user", "content": "Generate a Cursed Archive viral short concept."}
+                {"role": "system", "content": self.SYSTEM_PROMPT},
+                {"role": "user", "content": user_msg}
             ],
             model="llama-3.3-70b-versatile",
             response_format={"type": "json_object"}
         )
         return json.loads(completion.choices[0].message.content)
 
+    def _generate(self, targets, avoid=(), attempts=3):
+        """Valid (repaired) concepts from one completion. A malformed response or one with no
+        usable concept is retried, up to `attempts` completions."""
+        for attempt in range(attempts):
+            try:
+                data = self._complete(self._user_message(targets, avoid))
+            except Exception as e: # API error or invalid JSON
+                print(f"⚠️ Concept generation failed (attempt {attempt+1}): {e}")
+                tracer.count("retries")
+                continue
+            raw = data.get("concepts", [data]) if isinstance(data, dict) else data
+            concepts = [c for c in map(validate_concept, raw if isinstance(raw, list) else []) if c]
+            if concepts:
+                return concepts
+            print(f"⚠️ No valid concept in response (attempt {attempt+1}). Retrying...")
+            tracer.count("retries")
+        raise ValueError(f"No valid concept after {attempts} attempts")
+
+    def _targets(self, n):
+        return [(random.choice(self.REACTIONS), random.choice(self.FORMATS)) for _ in range(n)]
+
+    @tracer.traced("brain.concept")
+    def generate_viral_concept(self):
+        (reaction, fmt), = targets = self._targets(1)
+        print(f"🧠 Brain Active: Target Reaction={reaction} | Format={fmt}")
+        return self._generate(targets)[0]
+
+    @tracer.traced("brain.concepts_batch")
+    def generate_viral_concepts(self, n, avoid=()):
+        """N concepts from a single completion (topped up one by one if the model returns too few)."""
+        if n <= 1:
+            return [self.generate_viral_concept()]
+
+        print(f"🧠 Brain Active: Batch of {n} concepts")
+        try:
+            concepts = self._generate(self._targets(n), avoid)
+        except Exception as e:
+            print(f"⚠️ Batch concept generation failed: {e}")
+            concepts = []
+
+        while len(concepts) < n:
+            concepts.append(self.generate_viral_concept())
+        return concepts[:n]
+
+# Field -> type. Concepts are repaired towards this before use; see validate_concept().
+CONCEPT_SCHEMA = {
+    "title": str, "target_reaction": str, "hook_visual": str, "hook_audio": str, "hook_text": str,
+    "script_body": str, "visual_prompts": list, "description": str, "hashtags": str,
+}
+CONCEPT_REQUIRED = ("title", "hook_visual", "hook_audio", "script_body", "visual_prompts")
+
+def validate_concept(concept):
+    """A repaired copy of an LLM concept that matches CONCEPT_SCHEMA, or None if it can't be used.
+    Fixes the usual slips: prompts as one string, hashtags as a list, nested prompt objects,
+    missing cosmetic fields."""
+    if not isinstance(concept, dict):
+        return None
+    c = dict(concept)
+
+    prompts = c.get("visual_prompts")
+    if isinstance(prompts, str):
+        prompts = re.split(r"\n|;", prompts)
+    if isinstance(prompts, list):
+        prompts = [p.get("prompt", "") if isinstance(p, dict) else str(p) for p in prompts]
+        prompts = [p.strip(" -•\t") for p in prompts if p and p.strip(" -•\t")][:5]
+    c["visual_prompts"] = prompts or []
+
+    for field, kind in CONCEPT_SCHEMA.items():
+        value = c.get(field)
+        if kind is str and value is not None and not isinstance(value, str):
+            c[field] = " ".join(map(str, value)) if isinstance(value, list) else str(value)
+    c.setdefault("target_reaction", "")
+    if not c.get("hook_text"): c["hook_text"] = "WAIT FOR IT"
+    if not c.get("description"): c["description"] = c.get("title", "")
+    if not c.get("hashtags"): c["hashtags"] = "#shorts #cursed"
+
+    if any(not c.get(field) for field in CONCEPT_REQUIRED):
+        return None
+    return c
+
+# --- 1.5. CONCEPT POOL ---
+CONCEPT_POOL_BATCH = int(os.environ.get("CONCEPT_POOL_BATCH", "5")) # Concepts per completion
+CONCEPT_POOL_LOW = int(os.environ.get("CONCEPT_POOL_LOW", "2")) # Refill in the background below this
+CONCEPT_SIMILARITY = 0.85 # Title or hook this close to a pooled/used one counts as a duplicate
+
+def _normalize(text):
+    return " ".join(re.findall(r"[a-z0-9]+", (text or "").lower()))
+
+def similar_concepts(a, b):
+    return any(
+        difflib.SequenceMatcher(None, _normalize(a.get(k)), _normalize(b.get(k))).ratio() >= CONCEPT_SIMILARITY
+        for k in ("title", "hook_audio")
+    )
+
+class ConceptPool:
+    """Validated concepts waiting for a run, persisted as JSON next to the runs.
+
+    Concepts are generated CONCEPT_POOL_BATCH per completion, deduplicated against the
+    pool and the recently used ones, and handed out one per run. When the pool drops
+    below CONCEPT_POOL_LOW it is topped up in the background, so most runs take a
+    concept without waiting on the LLM at all."""
+
+    def __init__(self, path, history=200):
+        self.path = path
+        self.history = history
+        self._brain = None
+        self._lock = threading.Lock()
+        self._refilling = False
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+        else:
+            state = {}
+        self.pool = state.get("pool", [])
+        self.used = state.get("used", [])
+
+    def brain(self):
+        if self._brain is None:
+            self._brain = ViralBrain(GROQ_KEY)
+        return self._brain
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"pool": self.pool, "used": self.used}, f, indent=2)
+        os.replace(tmp, self.path)
+
+    def available(self):
+        with self._lock:
+            return len(self.pool)
+
+    def add(self, concepts):
+        """Pool the non-duplicates. Returns how many were added."""
+        added = 0
+        with self._lock:
+            for c in concepts:
+                if any(similar_concepts(c, seen) for seen in self.pool + self.used):
+                    print(f"   ♻️ Skipping duplicate concept: {c['title']}")
+                    continue
+                self.pool.append(c)
+                added += 1
+            self._save()
+        return added
+
+    def refill(self, n=CONCEPT_POOL_BATCH):
+        with self._lock:
+            avoid = [c["title"] for c in self.used[-10:]]
+        concepts = self.brain().generate_viral_concepts(n, avoid=avoid)
+        if not self.add(concepts) and not self.available():
+            # Everything came back as a repeat; a repeat beats failing the run
+            with self._lock:
+                self.pool.append(concepts[0])
+                self._save()
+
+    def _refill_background(self):
+        with self._lock:
+            if self._refilling or len(self.pool) >= CONCEPT_POOL_LOW:
+                return
+            self._refilling = True
+
+        def refill():
+            try:
+                self.refill()
+            except Exception as e:
+                print(f"⚠️ Background concept refill failed: {e}")
+            finally:
+                self._refilling = False
+        _job_pool.submit(refill)
+
+    def take_many(self, n):
+        taken = []
+        while len(taken) < n:
+            with self._lock:
+                batch, self.pool = self.pool[:n - len(taken)], self.pool[n - len(taken):]
+                self.used = (self.used + batch)[-self.history:]
+                self._save()
+            taken += batch
+            if len(taken) < n:
+                self.refill(max(CONCEPT_POOL_BATCH, n - len(taken)))
+        self._refill_background()
+        return taken
+
+    def take(self):
+        return self.take_many(1)[0]
+
+_concept_pool = None
+_concept_pool_lock = threading.Lock()
+
+def get_concept_pool():
+    global _concept_pool
+    with _concept_pool_lock:
+        if _concept_pool is None:
+            _concept_pool = ConceptPool(os.path.join(RUNS_DIR, "concept_pool.json"))
+    return _concept_pool
+
 def get_concept():
-    # Legacy wrapper or replacement
-    brain = ViralBrain(GROQ_KEY)
-    return brain.generate_viral_concept()
+    return get_concept_pool().take()
 
 # --- 2. SUBMAGIC CLIENT (Auto-Captions) ---
 class SubmagicClient:
-    BASE_URL = "https://api.submagic.co/v1"
+    BASE_URL = os.environ.get("SUBMAGIC_BASE_URL", "https://api.submagic.co/v1")
 
     def __init__(self):
         self.api_key = os.environ.get("SUBMAGIC_API_KEY")
         if not self.api_key:
             print("⚠️ SUBMAGIC_API_KEY not found! Captions will be skipped.")
 
+    @tracer.traced("captions.submagic")
     def process_video(self, video_path, title):
         if not self.api_key:
             return video_path
@@ -101,20 +884,20 @@ class SubmagicClient:
         
         # 1. Upload Video
         upload_url = f"{self.BASE_URL}/projects"
-        headers = {"x-api-key": self.api_key} # Content-Type is set by requests for multipart
         
         try:
+            http = get_http()
             # 3: Verify Submagic Upload Payload (Debug)
-            # Some APIs need the file tuple to be (filename, file_object, content_type)
-            with open(video_path, 'rb') as f:
-                # Based on search results: 'file', 'title', 'language', 'templateName'
-                files = {'file': (os.path.basename(video_path), f, 'video/mp4')}
-                data = {
-                    'title': title[:100],
-                    'language': 'en',
-                    'templateName': 'Hormozi 2' 
-                }
-                res = requests.post(upload_url, headers=headers, files=files, data=data) 
+            # Based on search results: 'file', 'title', 'language', 'templateName'
+            data = {
+                'title': title[:100],
+                'language': 'en',
+                'templateName': 'Hormozi 2' 
+            }
+            body = MultipartFile(video_path, 'file', data, content_type='video/mp4')
+            headers = {"x-api-key": self.api_key, "Content-Type": body.content_type}
+            res = http.post(upload_url, headers=headers, data=body, timeout=UPLOAD_TIMEOUT) 
+            tracer.count("bytes_out", os.path.getsize(video_path))
             
             if res.status_code not in [200, 201]:
                 print(f"⚠️ Submagic Upload Failed: {res.status_code} - {res.text}")
@@ -133,71 +916,68 @@ class SubmagicClient:
             
             # 2. Poll for Completion
             # Rate limit check: "Standard operations... 500/hour". 
-            # We poll every 10s.
-            for attempt in range(60): # 10 minutes timeout
-                time.sleep(10)
-                status_url = f"{self.BASE_URL}/projects/{project_id}"
-                status_res = requests.get(status_url, headers=headers)
-                
-                if status_res.status_code == 200:
-                    status_data = status_res.json()
-                    # Flatten if inside 'data'
-                    if 'data' in status_data: status_data = status_data['data']
-                    
-                    status = status_data.get('status')
-                    print(f"      ...Status: {status}")
-                    
-                    if status == 'completed':
-                        # Look for download URL. 
-                        # Sometimes it's 'videoUrl', 'downloadUrl', or we need to hit /export.
-                        # User mentioned "Export operations". Let's try export if no URL found.
-                        download_url = status_data.get('videoUrl') or status_data.get('downloadUrl')
-                        
-                        if not download_url:
-                            # Try explicit export (blind attempt based on user prompt hint)
-                            print("      ...Triggering Export...")
-                            export_url = f"{self.BASE_URL}/projects/{project_id}/export"
-                            # Export might be blocking or return a url
-                            export_res = requests.post(export_url, headers=headers)
-                            if export_res.status_code == 200:
-                                export_data = export_res.json()
-                                if 'data' in export_data: export_data = export_data['data']
-                                download_url = export_data.get('url')
-                        
-                        if download_url:
-                            print(f"   ✅ Submagic Success! Downloading captions...")
-                            # Download
-                            final_res = requests.get(download_url)
-                            captioned_path = video_path.replace(".mp4", "_submagic.mp4")
-                            with open(captioned_path, "wb") as f_out:
-                                f_out.write(final_res.content)
-                            return captioned_path
-                        else:
-                            print("⚠️ Submagic Completed but no URL found.")
-                            return video_path
-                            
-                    elif status == 'failed':
-                        print("❌ Submagic Processing Failed.")
-                        return video_path
-                else:
-                    print(f"   Polling Error: {status_res.status_code}")
-                    
+            # Backoff starts at 5s and stretches to 60s, honouring any Retry-After.
+            def check(status_data):
+                # Flatten if inside 'data'
+                if 'data' in status_data: status_data = status_data['data']
+                status = status_data.get('status')
+                print(f"      ...Status: {status}")
+                if status == 'completed':
+                    return status_data
+                if status == 'failed':
+                    raise JobFailed("Submagic Processing Failed.")
+                return None
+
+            status_url = f"{self.BASE_URL}/projects/{project_id}"
+            status_data = poll_job(
+                lambda: http.get(status_url, headers=headers, timeout=HTTP_TIMEOUT), check,
+                label="Submagic", base_delay=5, max_delay=60, timeout=600
+            )
+
+            # Look for download URL. 
+            # Sometimes it's 'videoUrl', 'downloadUrl', or we need to hit /export.
+            # User mentioned "Export operations". Let's try export if no URL found.
+            download_url = status_data.get('videoUrl') or status_data.get('downloadUrl')
+            
+            if not download_url:
+                # Try explicit export (blind attempt based on user prompt hint)
+                print("      ...Triggering Export...")
+                export_url = f"{self.BASE_URL}/projects/{project_id}/export"
+                # Export might be blocking or return a url
+                export_res = http.post(export_url, headers=headers, timeout=UPLOAD_TIMEOUT)
+                if export_res.status_code == 200:
+                    export_data = export_res.json()
+                    if 'data' in export_data: export_data = export_data['data']
+                    download_url = export_data.get('url')
+            
+            if download_url:
+                print(f"   ✅ Submagic Success! Downloading captions...")
+                captioned_path = video_path.replace(".mp4", "_submagic.mp4")
+                return download_file(download_url, captioned_path)
+            else:
+                print("⚠️ Submagic Completed but no URL found.")
+                return video_path
+
+        except JobFailed as e:
+            print(f"❌ {e}")
+            return video_path
+        except TimeoutError:
             print("⚠️ Submagic Timeout.")
             return video_path
-
         except Exception as e:
             print(f"⚠️ Submagic Client Error: {e}")
             return video_path
 
 # --- 2.5. CREATOMATE CLIENT (Fallback Captions) ---
 class CreatomateClient:
-    BASE_URL = "https://api.creatomate.com/v2/renders"
+    BASE_URL = os.environ.get("CREATOMATE_BASE_URL", "https://api.creatomate.com/v2/renders")
     
     def __init__(self):
         self.api_key = os.environ.get("CREATOMATE_API_KEY")
         if not self.api_key:
             print("⚠️ CREATOMATE_API_KEY not found! Fallback will be skipped.")
 
+    @tracer.traced("captions.creatomate")
     def process_video(self, video_path, text_overlay):
         if not self.api_key:
             return video_path
@@ -235,8 +1015,9 @@ class CreatomateClient:
         }
         
         try:
+            http = get_http()
             print("      ...Triggering Render...")
-            res = requests.post(self.BASE_URL, headers=headers, json=data)
+            res = http.post(self.BASE_URL, headers=headers, json=data, timeout=HTTP_TIMEOUT)
             
             if res.status_code != 200:
                 print(f"⚠️ Creatomate Render Req Failed: {res.text}")
@@ -244,34 +1025,30 @@ class CreatomateClient:
                 
             render_data = res.json()[0] # Returns array
             render_id = render_data.get('id')
-            status = render_data.get('status')
-            
-            # 3. Poll
-            for _ in range(60): # 10 min
+
+            def check(render_data):
+                status = render_data.get('status')
                 if status == 'succeeded':
-                    url = render_data.get('url')
-                    print(f"   ✅ Creatomate Success! Downloading...")
-                    final_res = requests.get(url)
-                    out_path = video_path.replace(".mp4", "_creatomate.mp4")
-                    with open(out_path, "wb") as f:
-                        f.write(final_res.content)
-                    return out_path
-                    
-                elif status == 'failed':
-                    print(f"❌ Creatomate Failed: {render_data.get('errorMessage')}")
-                    return video_path
-                    
-                time.sleep(5)
-                # Refresh status
-                check_res = requests.get(f"{self.BASE_URL}/{render_id}", headers=headers)
-                if check_res.status_code == 200:
-                    render_data = check_res.json()
-                    status = render_data.get('status')
-                else:
-                    print("pwning polling...")
-                    
-            return video_path
+                    return render_data
+                if status == 'failed':
+                    raise JobFailed(f"Creatomate Failed: {render_data.get('errorMessage')}")
+                return None
+
+            # 3. Poll (the create call may already report a finished render)
+            if check(render_data) is None:
+                render_data = poll_job(
+                    lambda: http.get(f"{self.BASE_URL}/{render_id}", headers=headers, timeout=HTTP_TIMEOUT), check,
+                    label="Creatomate", base_delay=3, max_delay=30, timeout=600
+                )
+
+            url = render_data.get('url')
+            print(f"   ✅ Creatomate Success! Downloading...")
+            out_path = video_path.replace(".mp4", "_creatomate.mp4")
+            return download_file(url, out_path)
             
+        except JobFailed as e:
+            print(f"❌ {e}")
+            return video_path
         except Exception as e:
             print(f"⚠️ Creatomate Error: {e}")
             return video_path
@@ -279,9 +1056,10 @@ class CreatomateClient:
     def _upload_to_temp_host(self, file_path):
         print("      ...Uploading to temp host (file.io) for URL...")
         try:
-            with open(file_path, 'rb') as f:
-                # 14 days retention, 1 download limit (auto delete)
-                res = requests.post('https://file.io', files={'file': f}, data={'expires': '1d'})
+            # 14 days retention, 1 download limit (auto delete)
+            body = MultipartFile(file_path, 'file', {'expires': '1d'})
+            res = get_http().post(TEMP_HOST_URL, headers={"Content-Type": body.content_type}, data=body, timeout=UPLOAD_TIMEOUT)
+            tracer.count("bytes_out", os.path.getsize(file_path))
             
             if res.status_code == 200:
                 link = res.json().get('link')
@@ -295,15 +1073,12 @@ class CreatomateClient:
             return None
 
 # --- 3. IMAGE GENERATOR (Freepik Mystic) ---
-def generate_image_freepik(prompt, filename):
-    print(f"🎨 Generating Image (Freepik): {filename}...")
-    api_key = os.environ.get("FREEPIK_API_KEY")
-    if not api_key:
-        print("⚠️ FREEPIK_API_KEY not found. Using fallback placeholder.")
-        PIL.Image.new('RGB', (720, 1280), (20, 20, 20)).save(filename)
-        return filename
+POLLINATIONS_BASE_URL = os.environ.get("POLLINATIONS_BASE_URL", "https://image.pollinations.ai")
+IMAGE_BACKUP = os.environ.get("IMAGE_BACKUP", "pollinations") # "none" disables the backup provider
 
-    url = "https://api.freepik.com/v1/ai/mystic"
+def freepik_image(prompt, filename, cancel=None):
+    api_key = os.environ.get("FREEPIK_API_KEY")
+    url = f"{FREEPIK_BASE_URL}/v1/ai/mystic"
     headers = {
         "x-freepik-api-key": api_key,
         "Content-Type": "application/json",
@@ -318,43 +1093,69 @@ def generate_image_freepik(prompt, filename):
         "filter_nsfw": False # CAUTION: Requires permission, otherwise ignored/true
     }
 
-    try:
-        # 1. Start Generation
-        res = requests.post(url, json=payload, headers=headers)
-        if res.status_code != 200:
-            print(f"❌ Freepik Request Failed: {res.text}")
-            raise Exception(f"Freepik API Error: {res.status_code}")
-        
-        task_data = res.json().get("data", {})
-        task_id = task_data.get("task_id")
-        print(f"   Task Started: {task_id}")
-
-        # 2. Poll for Completion
-        for _ in range(30): # Timeout ~60s
-            time.sleep(2)
-            check_url = f"{url}/{task_id}"
-            check_res = requests.get(check_url, headers=headers)
-            if check_res.status_code == 200:
-                status_data = check_res.json().get("data", {})
-                status = status_data.get("status")
-                
-                if status == "COMPLETED":
-                    img_url = status_data.get("generated", [])[0]
-                    print(f"   Image Function Success: {img_url}")
-                    
-                    # Download Image
-                    img_res = requests.get(img_url)
-                    with open(filename, "wb") as f:
-                        f.write(img_res.content)
-                    return filename
-                elif status == "FAILED":
-                    print("❌ Freepik Task Failed.")
-                    break
-            else:
-                print(f"   Polling Error: {check_res.status_code}")
+    http = get_http()
+    # 1. Start Generation
+    res = http.post(url, json=payload, headers=headers, timeout=HTTP_TIMEOUT)
+    if res.status_code != 200:
+        print(f"❌ Freepik Request Failed: {res.text}")
+        raise Exception(f"Freepik API Error: {res.status_code}")
+    
+    task_data = res.json().get("data", {})
+    task_id = task_data.get("task_id")
+    print(f"   Task Started: {task_id}")
 
-    except Exception as e:
-        print(f"⚠️ Image Generation Error: {e}")
+    # 2. Poll for Completion
+    def check(status_data):
+        status_data = status_data.get("data", {})
+        status = status_data.get("status")
+        if status == "COMPLETED":
+            return status_data.get("generated", [])[0]
+        if status == "FAILED":
+            raise JobFailed("Freepik Task Failed.")
+        return None
+
+    check_url = f"{url}/{task_id}"
+    img_url = poll_job(
+        lambda: http.get(check_url, headers=headers, timeout=HTTP_TIMEOUT), check,
+        label="Freepik", base_delay=1, max_delay=8, timeout=60, cancel=cancel
+    )
+    print(f"   Image Function Success: {img_url}")
+
+    # Download Image
+    return download_file(img_url, filename)
+
+def pollinations_image(prompt, filename, cancel=None):
+    # Synchronous text-to-image GET; no key, no job to poll
+    seed = random.randint(0, 2**31 - 1)
+    url = f"{POLLINATIONS_BASE_URL}/prompt/{urllib.parse.quote(prompt)}?width=720&height=1280&nologo=true&seed={seed}"
+    download_file(url, filename)
+    with PIL.Image.open(filename) as img:
+        img.verify()
+    return filename
+
+@tracer.traced("image.freepik")
+def generate_image_freepik(prompt, filename):
+    print(f"🎨 Generating Image (Freepik): {filename}...")
+    cache_key = asset_cache.key("image", "freepik:mystic/realism|pollinations", prompt, aspect_ratio="social_story_9_16")
+    if asset_cache.fetch(cache_key, filename):
+        print(f"   ♻️ Cache hit: {filename}")
+        return filename
+
+    providers = []
+    if os.environ.get("FREEPIK_API_KEY"):
+        providers.append(("Freepik", lambda path, cancel: freepik_image(prompt, path, cancel)))
+    else:
+        print("⚠️ FREEPIK_API_KEY not found.")
+    if IMAGE_BACKUP == "pollinations":
+        providers.append(("Pollinations", lambda path, cancel: pollinations_image(prompt, path, cancel)))
+
+    if providers:
+        try:
+            hedged_to_file("Image", providers, filename, IMAGE_HEDGE_AFTER)
+            asset_cache.store(cache_key, filename)
+            return filename
+        except Exception as e:
+            print(f"⚠️ Image Generation Error: {e}")
 
     # Fallback
     print("   Using fallback image.")
@@ -362,209 +1163,1616 @@ def generate_image_freepik(prompt, filename):
     return filename
 
 # --- 3. VIDEO GENERATOR (Wan 2.2 I2V) ---
-from gradio_client import handle_file
 
-def animate_wan_i2v(image_path, prompt, max_retries=3):
-    print(f"🎬 Connecting to Wan-AI/Wan2.2 (I2V)...")
-    
-    for attempt in range(max_retries):
-        try:
-            client = Client("r3gm/wan2-2-fp8da-aoti-preview2")
-            
-            print(f"   Requesting animation for {image_path} (Attempt {attempt+1})...")
-            
-            # Based on user-provided API docs for /generate_video
-            result = client.predict(
-                input_image=handle_file(image_path),
-                last_image=None,
-                prompt=f"found footage horror style, {prompt}, cinematic motion, smooth animation",
-                steps=6,
-                negative_prompt="bright, cartoon, static, low quality, watermark, text",
-                duration_seconds=5,
-                guidance_scale=1,
-                guidance_scale_2=1,
-                seed=42,
-                randomize_seed=True,
-                quality=6,
-                scheduler="UniPCMultistep",
-                flow_shift=3,
-                frame_multiplier=16,
-                video_component=True,
-                api_name="/generate_video"
-            )
-            
-            # Result is tuple: (filepath, filepath, seed)
-            # We want the video path [0]
-            video_path = result[0]
-            print(f"   Generation complete! Video at: {video_path}")
-            
-            final_name = "wan_climax.mp4"
-            shutil.copy(video_path, final_name)
-            return final_name
+ANIMATION_BACKENDS = [b.strip() for b in os.environ.get("ANIMATION_BACKEND", "space").split(",") if b.strip()] # Tried in order
+WAN_QUALITY = os.environ.get("WAN_QUALITY", "full")
+WAN_SETTINGS = {
+    # Frame counts are 4k+1 and sizes multiples of 16, as Wan requires
+    "draft": {"steps": 4, "width": 320, "height": 576, "num_frames": 33, "duration_seconds": 2},
+    "full": {"steps": 6, "width": 480, "height": 832, "num_frames": 81, "duration_seconds": 5},
+}
+WAN_NEGATIVE_PROMPT = "bright, cartoon, static, low quality, watermark, text"
+# Wan 2.2 I2V-A14B is two experts: high-noise (early steps) and low-noise (late steps). From download-wan.yml
+WAN_GGUF_HIGH = os.environ.get("WAN_GGUF_HIGH", "models/HighNoise/Wan2.2-I2V-A14B-HighNoise-Q4_K_M.gguf")
+WAN_GGUF_LOW = os.environ.get("WAN_GGUF_LOW", "models/LowNoise/Wan2.2-I2V-A14B-LowNoise-Q4_K_M.gguf")
+WAN_LOCAL_BASE = os.environ.get("WAN_LOCAL_BASE", "models/Wan2.2-I2V-A14B-Diffusers") # VAE, text encoder, configs (no transformer weights)
+WAN_I2V_IN_CHANNELS = 36 # 16 noise + 16 image-latent + 4 mask channels; T2V checkpoints take 16
+WAN_LOCAL_TIMEOUT = float(os.environ.get("WAN_LOCAL_TIMEOUT", "3600"))
 
-        except Exception as e:
-            print(f"⚠️ Video Attempt {attempt+1} failed: {e}")
-            time.sleep(10)
-            
-    return None
+def wan_prompt(prompt):
+    return f"found footage horror style, {prompt}, cinematic motion, smooth animation"
 
-# --- 4. EDITOR (Viral Engine) ---
-def create_viral_short(hook_video_path, body_image_paths, hook_audio_path, body_audio_path, hook_text, output_filename):
-    print("✂️ Editing Viral Short (Smart Sync)...")
-    
-    # Load Audios
-    hook_audio = AudioFileClip(hook_audio_path)
-    body_audio = AudioFileClip(body_audio_path)
-    total_audio_duration = hook_audio.duration + body_audio.duration
-    
-    clips = []
-    
-    # --- 1. THE HOOK (Synced to Audio) ---
-    hook_duration = hook_audio.duration
-    
-    # Visual Hook: Wan 2.2 generated video OR fallback image
-    if os.path.exists(hook_video_path):
-        # Determine if video or image
-        if hook_video_path.lower().endswith(('.mp4', '.mov', '.avi')):
-            video_clip = VideoFileClip(hook_video_path).resize(height=1280)
-            # Center crop to 720x1280
-            if video_clip.w > 720:
-                 video_clip = video_clip.crop(x1=video_clip.w/2 - 360, width=720)
-            
-            # Logic: If Audio > Video, freeze the last frame. If Audio < Video, cut video.
-            if hook_duration > video_clip.duration:
-                # Freeze frame extension
-                freeze_duration = hook_duration - video_clip.duration
-                frozen_frame = video_clip.to_ImageClip(t=video_clip.duration - 0.1).set_duration(freeze_duration)
-                hook_clip = concatenate_videoclips([video_clip, frozen_frame])
-            else:
-                hook_clip = video_clip.subclip(0, hook_duration)
-                
-        else:
-            # Fallback to ImageClip if it's a jpg/png
-            hook_clip = ImageClip(hook_video_path).set_duration(hook_duration).resize(height=1280)
-            if hook_clip.w > 720:
-                 hook_clip = hook_clip.crop(x1=hook_clip.w/2 - 360, width=720)
-            # Apply subtle zoom to static hook
-            hook_clip = hook_clip.resize(lambda t: 1 + 0.05*t)
-        
-        # Text Hook: Overlay
-        try:
-            txt_clip = TextClip(hook_text, fontsize=70, color='white', font='Arial-Bold', stroke_color='black', stroke_width=2, size=(600, None), method='caption')
-            txt_clip = txt_clip.set_position('center').set_duration(hook_duration)
-            hook_clip = CompositeVideoClip([hook_clip, txt_clip])
-        except Exception:
-            pass # Silent fail
-            
-        # Bind audio
-        hook_clip = hook_clip.set_audio(hook_audio)
-        clips.append(hook_clip)
-    else:
-        # Emergency fallback if no hook media?
-        # Just use black screen? Or skip.
-        pass
+class SpaceAnimator:
+    """Wan 2.2 I2V on the public Hugging Face Space."""
+    name = "space"
 
-    # --- 2. THE BODY (Synced to Body Audio) ---
-    body_duration = body_audio.duration
-    
-    if body_duration > 0 and body_image_paths:
-        # Calculate duration per image based on BODY audio
-        num_images = len(body_image_paths)
-        duration_per_image = body_duration / num_images
-        
-        for i, img_path in enumerate(body_image_paths):
-            if not os.path.exists(img_path): continue
-            
-            # Create Clip
-            img_clip = ImageClip(img_path).set_duration(duration_per_image)
-            img_clip = img_clip.resize(height=1280)
-            if img_clip.w > 720:
-                img_clip = img_clip.crop(x1=img_clip.w/2 - 360, width=720)
-            
-            # Apply "Ken Burns" (Zoom/Pan)
-            effect = random.choice(['zoom_in', 'zoom_out', 'pan'])
-            if effect == 'zoom_in':
-                img_clip = img_clip.resize(lambda t: 1 + 0.05*t)
-            elif effect == 'zoom_out':
-                img_clip = img_clip.resize(lambda t: 1.2 - 0.05*t) 
-            
-            clips.append(img_clip)
-        
-        # Create body composite (sequence of images)
-        # Verify timestamps... concatenate_videoclips handles basic sequencing
-        # But we need to set the collective audio for the body part?
-        # No, easier to just concat the visual clips first, then set audio? 
-        # Actually, let's keep them as a list and concat all at the end.
-        pass
-    
-    # Concatenate all visual clips (Hook + Body Images)
-    final_video = concatenate_videoclips(clips, method="compose")
-    
-    # Composite Audio (Hook Audio + Body Audio)
-    # Note: concatenate_videoclips might preserve audio if clips have it. 
-    # Hook has audio. Body images don't.
-    # We need to explicitly set the Body Audio to start after Hook.
-    # Safest: Create a composite audio clip.
-    full_audio = concatenate_audioclips([hook_audio, body_audio])
-    final_video = final_video.set_audio(full_audio)
-    
-    # Ensure exact duration match
-    # STRICT SHORTS LIMIT: 59 seconds max to be safe.
-    final_duration = min(final_video.duration, 59.0)
-    final_video = final_video.set_duration(final_duration)
-    
-    final_video.write_videofile(output_filename, fps=24, codec='libx264', audio_codec='aac', temp_audiofile='temp-audio.m4a', remove_temp=True)
-    return output_filename
+    def model(self):
+        return WAN_SPACE
 
-def generate_audio_kokoro(text, filename):
-    print("   🎙️ Generating audio (Kokoro TTS)...")
+    def animate(self, image_path, prompt, out_path, settings, seed, max_retries=3, cancel=None):
+        from gradio_client import handle_file
+        for attempt in range(max_retries):
+            try:
+                client = spaces.get(WAN_SPACE)
+                print(f"   Requesting animation for {image_path} (Attempt {attempt+1})...")
+
+                # Based on user-provided API docs for /generate_video
+                job = client.submit(
+                    input_image=handle_file(image_path),
+                    last_image=None,
+                    prompt=wan_prompt(prompt),
+                    steps=settings["steps"],
+                    negative_prompt=WAN_NEGATIVE_PROMPT,
+                    duration_seconds=settings["duration_seconds"],
+                    guidance_scale=1,
+                    guidance_scale_2=1,
+                    seed=seed,
+                    randomize_seed=False,
+                    quality=6,
+                    scheduler="UniPCMultistep",
+                    flow_shift=3,
+                    frame_multiplier=16,
+                    video_component=True,
+                    api_name="/generate_video"
+                )
+                result = _await_gradio(job, cancel)
+
+                # Result is tuple: (filepath, filepath, seed)
+                # We want the video path [0]
+                video_path = result[0]
+                print(f"   Generation complete! Video at: {video_path}")
+                shutil.copy(video_path, out_path)
+                return out_path
+
+            except Cancelled:
+                raise
+            except Exception as e:
+                print(f"⚠️ Video Attempt {attempt+1} failed: {e}")
+                tracer.count("retries")
+                spaces.invalidate(WAN_SPACE)
+                if attempt < max_retries - 1:
+                    delay = min(2 ** (attempt + 1), 10) * random.uniform(0.75, 1.25)
+                    if cancel is not None and cancel.wait(delay):
+                        raise Cancelled("Wan Space cancelled")
+                    elif cancel is None:
+                        time.sleep(delay)
+        raise RuntimeError(f"Wan Space failed after {max_retries} attempts")
+
+def check_wan_checkpoint(path):
+    """Raise ValueError unless `path` is a Wan I2V GGUF checkpoint. A T2V file has the
+    same transformer blocks and would otherwise fail deep inside the load (or worse, load)."""
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Local Wan model not found at {path} (run the Download Wan 2.2 workflow or set WAN_GGUF_HIGH/WAN_GGUF_LOW)")
+    if "t2v" in os.path.basename(path).lower():
+        raise ValueError(f"{path} is a text-to-video checkpoint; the local backend needs the Wan 2.2 I2V-A14B GGUF quants")
     try:
-        client = Client("https://yakhyo-kokoro-onnx.hf.space/")
-        result = client.predict(
-            text=text,
-            model_path="kokoro-quant.onnx",
-            style_vector="am_adam.pt", # Male voice
-            output_file_format="mp3",
-            speed=1,
-            api_name="/local_tts"
-        )
-        shutil.copy(result, filename)
-        return filename
-    except Exception as e:
-        print(f"   ⚠️ Kokoro Init Error: {e}")
-        raise e
+        from gguf import GGUFReader
+    except ImportError:
+        return
+    for tensor in GGUFReader(path).tensors:
+        if tensor.name.endswith("patch_embedding.weight"):
+            # GGUF stores dims innermost first: (kw, kh, kt, in_channels, out_channels)
+            in_channels = int(tensor.shape[3])
+            if in_channels != WAN_I2V_IN_CHANNELS:
+                raise ValueError(f"{path} takes {in_channels} input channels, not {WAN_I2V_IN_CHANNELS}: "
+                                 "it is not an image-to-video checkpoint (T2V?)")
+            return
 
-async def make_audio(text, filename):
+def _wan_worker_main(jobs, cancels, results, high_path, low_path, base_repo):
+    """Entry point of the local Wan process: load the pipeline once, then serve
+    (job_id, image, prompt, out_path, settings, seed) jobs until None arrives.
+    Job ids put on `cancels` are skipped if still queued, or interrupted mid-denoise."""
     try:
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, generate_audio_kokoro, text, filename)
-        print("   ✅ Kokoro TTS success.")
+        import torch
+        from diffusers import GGUFQuantizationConfig, WanImageToVideoPipeline, WanTransformer3DModel
+        from diffusers.utils import export_to_video, load_image
+        from transformers import UMT5EncoderModel
+
+        # Both experts from their quants; loading only one would make diffusers pull the other
+        # full-precision 14B expert from the base repo
+        quant = GGUFQuantizationConfig(compute_dtype=torch.bfloat16)
+        transformer, transformer_2 = (
+            WanTransformer3DModel.from_single_file(path, config=base_repo, subfolder=sub,
+                                                   torch_dtype=torch.bfloat16, quantization_config=quant)
+            for path, sub in ((high_path, "transformer"), (low_path, "transformer_2"))
+        )
+        text_encoder = UMT5EncoderModel.from_pretrained(base_repo, subfolder="text_encoder", torch_dtype=torch.bfloat16)
+        pipe = WanImageToVideoPipeline.from_pretrained(
+            base_repo, transformer=transformer, transformer_2=transformer_2, text_encoder=text_encoder,
+            torch_dtype=torch.bfloat16,
+        )
+        pipe.vae.to(torch.float32) # The VAE decodes with visible banding in bf16; it is small
+        pipe.to("cpu")
     except Exception as e:
-        print(f"   ⚠️ Kokoro TTS failed: {e}. Switching to EdgeTTS fallback...")
-        try:
-            await edge_tts.Communicate(text, "en-US-ChristopherNeural").save(filename)
-            print("   ✅ EdgeTTS success.")
-        except Exception as e2:
-             print(f"   ❌ All TTS failed: {e2}")
-             raise e2
+        results.put(("failed", None, f"model load failed: {e}"))
+        return
+    results.put(("ready", None, None))
 
-# --- 5. UPLOADER ---
-def upload_to_youtube(video_path, title, description, tags):
-    if isinstance(tags, list):
-        tag_list = tags
-        tag_str = " ".join(tags)
-    else:
-        tag_list = tags.split(',')
-        tag_str = tags # Assuming it is already a string
+    cancelled = set()
+    def drain_cancels():
+        while True:
+            try:
+                cancelled.add(cancels.get_nowait())
+            except Exception: # queue.Empty
+                return
 
-    # FORCE SHORTS METADATA
-    if "#Shorts" not in title:
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        job_id, image_path, prompt, out_path, settings, seed = job
+        drain_cancels()
+        if job_id in cancelled:
+            cancelled.discard(job_id)
+            continue
+
+        def check_cancel(pipe, step, timestep, callback_kwargs):
+            drain_cancels()
+            if job_id in cancelled:
+                pipe._interrupt = True # Remaining steps are skipped
+            return callback_kwargs
+
+        try:
+            image = load_image(image_path).resize((settings["width"], settings["height"]))
+            frames = pipe(
+                image=image, prompt=prompt, negative_prompt=WAN_NEGATIVE_PROMPT,
+                width=settings["width"], height=settings["height"], num_frames=settings["num_frames"],
+                num_inference_steps=settings["steps"], guidance_scale=1.0,
+                generator=torch.Generator().manual_seed(seed), callback_on_step_end=check_cancel,
+            ).frames[0]
+            if job_id in cancelled:
+                cancelled.discard(job_id)
+                continue # Nobody is waiting for it any more
+            export_to_video(frames, out_path, fps=16)
+            results.put((job_id, out_path, None))
+        except Exception as e:
+            results.put((job_id, None, str(e)))
+
+class LocalWanWorker:
+    """Wan 2.2 I2V from the GGUF checkpoints in ./models, on this machine's CPU.
+
+    The model lives in one long-lived process (spawned on first use, or by prewarm) that
+    takes jobs from a local queue one at a time. Slower per clip than the Space, but
+    with no public queue in front of it the latency is predictable."""
+    name = "local"
+
+    def __init__(self):
+        self._proc = None
+        self._jobs = None
+        self._cancels = None
+        self._futures = {}
+        self._ids = itertools.count()
+        self._error = None
+        self._lock = threading.Lock()
+        atexit.register(self.stop)
+
+    def model(self):
+        return f"{WAN_GGUF_HIGH}|{WAN_GGUF_LOW}|{WAN_LOCAL_BASE}"
+
+    def start(self):
+        with self._lock:
+            if self._proc is not None and self._proc.is_alive():
+                return
+            for path in (WAN_GGUF_HIGH, WAN_GGUF_LOW):
+                check_wan_checkpoint(path)
+            ctx = multiprocessing.get_context("spawn")
+            self._jobs, self._cancels, results = ctx.Queue(), ctx.Queue(), ctx.Queue()
+            self._error = None
+            self._proc = ctx.Process(target=_wan_worker_main, args=(self._jobs, self._cancels, results, WAN_GGUF_HIGH, WAN_GGUF_LOW, WAN_LOCAL_BASE),
+                                     name="wan-local", daemon=True)
+            self._proc.start()
+            threading.Thread(target=self._collect, args=(self._proc, results), name="wan-local-results", daemon=True).start()
+            print(f"   🧠 Loading local Wan model {WAN_GGUF_HIGH} + {os.path.basename(WAN_GGUF_LOW)} (pid {self._proc.pid})...")
+
+    def _fail_pending(self, error):
+        with self._lock:
+            self._error = error
+            futures, self._futures = self._futures, {}
+        for fut in futures.values():
+            fut.set_exception(RuntimeError(error))
+
+    def _collect(self, proc, results):
+        """Resolve job futures from the worker's result queue; fail them all if it dies."""
+        while True:
+            try:
+                job_id, path, error = results.get(timeout=5)
+            except Exception: # queue.Empty
+                if not proc.is_alive():
+                    self._fail_pending(f"local Wan worker exited ({proc.exitcode})")
+                    return
+                continue
+            if job_id == "ready":
+                print("   ✅ Local Wan model loaded.")
+            elif job_id == "failed":
+                self._fail_pending(error)
+                return
+            else:
+                with self._lock:
+                    fut = self._futures.pop(job_id, None)
+                if fut is None:
+                    continue
+                if error:
+                    fut.set_exception(RuntimeError(error))
+                else:
+                    fut.set_result(path)
+
+    def animate(self, image_path, prompt, out_path, settings, seed, max_retries=None, cancel=None):
+        self.start()
+        fut = Future()
+        with self._lock:
+            if self._error:
+                raise RuntimeError(self._error)
+            job_id = next(self._ids)
+            self._futures[job_id] = fut
+        self._jobs.put((job_id, os.path.abspath(image_path), wan_prompt(prompt), os.path.abspath(out_path), settings, seed))
+        deadline = time.monotonic() + WAN_LOCAL_TIMEOUT
+        while not fut.done():
+            if cancel is not None and cancel.wait(0.5):
+                self.cancel(job_id)
+                raise Cancelled("local Wan job cancelled")
+            elif cancel is None:
+                time.sleep(0.5)
+            if time.monotonic() > deadline:
+                self.cancel(job_id)
+                raise RuntimeError(f"local Wan gave no result within {WAN_LOCAL_TIMEOUT:g}s")
+        return fut.result()
+
+    def cancel(self, job_id):
+        """Forget a job; the worker drops it if still queued, or interrupts it if running."""
+        with self._lock:
+            self._futures.pop(job_id, None)
+        self._cancels.put(job_id)
+
+    def stop(self):
+        if self._proc is not None and self._proc.is_alive():
+            self._jobs.put(None)
+            self._proc.join(5)
+            if self._proc.is_alive():
+                self._proc.terminate()
+
+ANIMATORS = {"space": SpaceAnimator(), "local": LocalWanWorker()}
+
+WAN_BUDGET = hedge_budget("WAN_BUDGET", "180") # Seconds to wait for the Space before settling for the fallback hook
+# The local worker can't finish a clip on CPU in WAN_BUDGET, so it gets its own; the default
+# leaves the rest of the 60-minute daily job time to edit and upload
+WAN_LOCAL_BUDGET = hedge_budget("WAN_LOCAL_BUDGET", "1200")
+
+@tracer.traced("video.wan_i2v")
+def animate_wan_i2v(image_path, prompt, max_retries=3, final_name="wan_climax.mp4", backends=None, quality=None, budget=None):
+    """Animate a still with the first animation backend that succeeds (ANIMATION_BACKEND order).
+    A backend that runs out of its budget (`budget` seconds, WAN_LOCAL_BUDGET for the local
+    worker) is cancelled and the next one is tried. Returns None if none of them delivers."""
+    backends = backends or ANIMATION_BACKENDS
+    settings = WAN_SETTINGS[quality or WAN_QUALITY]
+    digest = asset_cache.file_digest(image_path)
+    keys = {name: asset_cache.key("wan", ANIMATORS[name].model(), prompt, image=digest, **settings) for name in backends}
+    for name in backends:
+        if asset_cache.fetch(keys[name], final_name):
+            print(f"   ♻️ Cache hit: {final_name}")
+            return final_name
+
+    seed = int(os.environ["WAN_SEED"]) if os.environ.get("WAN_SEED") else random.randint(0, 2**31 - 1)
+    for name in backends:
+        print(f"🎬 Animating hook with Wan 2.2 I2V ({name}, {quality or WAN_QUALITY})...")
+        limit = WAN_LOCAL_BUDGET if name == "local" and budget is not None else budget
+        try:
+            with tracer.span(f"video.wan:{name}"):
+                if _animate_within(ANIMATORS[name], limit, image_path, prompt, final_name, settings, seed, max_retries) is None:
+                    print(f"   ⏱️ Wan ({name}) gave no result within {limit:g}s.")
+                    continue
+            asset_cache.store(keys[name], final_name)
+            return final_name
+        except Exception as e:
+            print(f"⚠️ Wan backend '{name}' failed: {e}")
+    print("   Using the fallback hook.")
+    return None
+
+def _animate_within(animator, limit, image_path, prompt, final_name, settings, seed, max_retries):
+    """Run one backend, giving up and returning None after `limit` seconds (None waits for it).
+    The attempt runs on a daemon thread and writes a temp file, so one that ignores its cancel
+    event can neither hold up interpreter exit nor overwrite the result later."""
+    if limit is None:
+        return animator.animate(image_path, prompt, final_name, settings, seed, max_retries=max_retries)
+
+    root, ext = os.path.splitext(final_name)
+    pending = f"{root}.pending{ext}"
+    cancel, fut = threading.Event(), Future()
+
+    def attempt():
+        try:
+            fut.set_result(animator.animate(image_path, prompt, pending, settings, seed, max_retries=max_retries, cancel=cancel))
+        except BaseException as e:
+            fut.set_exception(e)
+
+    threading.Thread(target=attempt, name=f"wan-{animator.name}", daemon=True).start()
+    done, _ = wait([fut], timeout=limit)
+    if not done:
+        cancel.set()
+        return None
+    fut.result()
+    os.replace(pending, final_name)
+    return final_name
+
+# --- 3.5. PROCEDURAL MOTION (Hook Fallback) ---
+# A few seconds of fake motion from the hook still, made locally in parallel with Wan:
+# two-layer parallax, flicker, scanlines, chromatic shift, VHS band glitches and grain.
+HOOK_MOTION_SECONDS = 4.0 # Longer hook audio freezes the last frame, as with Wan clips
+
+def _depth_mask(buffer):
+    """Rough near/far split (lower, central and darker pixels count as near) as a feathered uint8 alpha."""
+    h, w = buffer.shape[:2]
+    lum = buffer.mean(axis=2) / 255.0
+    near = 0.5 * np.linspace(0, 1, h)[:, None] + 0.3 * (1 - np.abs(np.linspace(-1, 1, w)))[None, :] + 0.2 * (1 - lum)
+    mask = PIL.Image.fromarray(((near > np.percentile(near, 55)) * 255).astype(np.uint8))
+    # Down and back up again: a cheap wide blur so the layers don't tear at the seam
+    return np.asarray(mask.resize((w // 16, h // 16), PIL.Image.BILINEAR).resize((w, h), PIL.Image.BILINEAR))
+
+def _taps(start, step, n, limit, channels=1):
+    """2-tap (bilinear) sampling of n output pixels from a source axis of `limit` pixels, output
+    pixel i centered at start + (i + 0.5) * step. start and step may be per-frame vectors, giving
+    (frames, n) arrays. Returns (i0, i1, weight): the sample is src[i0] + (src[i1] - src[i0]) * weight / 128.
+    With channels > 1 the taps address the interleaved columns of a flat (h, w * channels) view."""
+    pos = np.asarray(start, dtype=np.float64)[..., None] + (np.arange(n) + 0.5) * np.asarray(step, dtype=np.float64)[..., None] - 0.5
+    pos = np.clip(pos, 0, limit - 1)
+    i0 = np.floor(pos).astype(np.intp)
+    i1 = np.minimum(i0 + 1, limit - 1)
+    weight = np.round((pos - i0) * 128).astype(np.int16)
+    if channels > 1:
+        ch = np.arange(channels)
+        i0, i1 = ((i[..., None] * channels + ch).reshape(i.shape[:-1] + (-1,)) for i in (i0, i1))
+        weight = np.repeat(weight, channels, axis=-1)
+    return i0, i1, weight
+
+def _bilinear(src, rows, cols, rowbufs, outbufs):
+    """Resample a flat int16 (h, w * channels) `src` through row then column taps, into
+    preallocated buffers. Weights are 0..128, so a pixel difference times a weight stays
+    inside int16. Returns outbufs[0]."""
+    (r0, r1, rw), (c0, c1, cw) = rows, cols
+    a, b = rowbufs
+    np.take(src, r0, axis=0, out=a)
+    np.take(src, r1, axis=0, out=b)
+    b -= a
+    b *= rw[:, None]
+    b >>= 7
+    a += b
+    c, d = outbufs
+    np.take(a, c0, axis=1, out=c)
+    np.take(a, c1, axis=1, out=d)
+    d -= c
+    d *= cw
+    d >>= 7
+    c += d
+    return c
+
+def _window(buffer_size, size, zoom, cx, cy):
+    """Row/column taps (rgb24 columns) for a size crop showing 1/zoom of the buffer, centered at (cx, cy) in [0, 1]."""
+    (bw, bh), (w, h) = buffer_size, size
+    win_w, win_h = bw / zoom, bh / zoom
+    x0 = min(max(cx * bw - win_w / 2, 0), bw - win_w)
+    y0 = min(max(cy * bh - win_h / 2, 0), bh - win_h)
+    return _taps(y0, win_h / h, h, bh), _taps(x0, win_w / w, w, bw, channels=3)
+
+def procedural_motion_frames(buffer, duration, size=(720, 1280), fps=None, seed=None):
+    """Yield uint8 frames. Per-frame randomness is drawn up front as vectors, and each frame is a
+    few whole-array int16 ops into preallocated buffers, on a flat (h, w*3) view."""
+    rng = np.random.default_rng(seed)
+    w, h = size
+    bh, bw = buffer.shape[:2]
+    fps = fps or FPS # defined with the editor settings below
+    n = max(1, int(round(duration * fps)))
+    src = buffer.astype(np.int16).reshape(bh, bw * 3)
+    # Alpha in 0..128 so (fg - bg) * alpha stays inside int16; repeated per channel, like src
+    mask = np.repeat((_depth_mask(buffer).astype(np.uint16) * 128 // 255).astype(np.int16), 3, axis=1)
+
+    flicker = 1 + rng.normal(0, 0.03, n)
+    flicker[rng.random(n) < 0.05] *= 0.6 # Occasional brownout
+    gain = np.round(flicker * 64).astype(np.int16) # Fixed point, >> 6
+    shift = (rng.random(n) < 0.2) * rng.integers(2, 9, n) # Chromatic aberration in px
+    glitch = rng.random(n) < 0.08
+    grain = np.repeat(rng.normal(0, 9, size=(4, h, w)).round().astype(np.int16), 3, axis=2)
+
+    rowbufs = (np.empty((h, bw * 3), dtype=np.int16), np.empty((h, bw * 3), dtype=np.int16))
+    bg = np.empty((h, w, 3), dtype=np.int16)
+    fg = np.empty((h, w, 3), dtype=np.int16)
+    scratch = np.empty((h, w * 3), dtype=np.int16)
+    alpha = np.empty((h, w * 3), dtype=np.int16)
+    bg2, fg2 = bg.reshape(h, w * 3), fg.reshape(h, w * 3)
+
+    for k in range(n):
+        p = k / max(1, n - 1)
+        # Background drifts left and barely zooms; the near layer drifts right and pushes in
+        rows, cols = _window((bw, bh), size, 1.04 + 0.03 * p, 0.5 - 0.01 * p, 0.5)
+        _bilinear(src, rows, cols, rowbufs, (bg2, scratch))
+        rows, cols = _window((bw, bh), size, 1.10 + 0.08 * p, 0.5 + 0.015 * p, 0.5 + 0.01 * p)
+        _bilinear(src, rows, cols, rowbufs, (fg2, scratch))
+        _bilinear(mask, rows, cols, rowbufs, (alpha, scratch))
+
+        # bg + (fg - bg) * alpha
+        fg2 -= bg2
+        fg2 *= alpha
+        fg2 >>= 7
+        bg2 += fg2
+        # Flicker, with every other row darker (scanlines), then grain
+        bg2[0::2] *= gain[k]
+        bg2[1::2] *= (int(gain[k]) * 7) >> 3
+        bg2 >>= 6
+        bg2 += grain[k % len(grain)]
+        np.clip(bg2, 0, 255, out=bg2)
+        out = bg.astype(np.uint8)
+
+        if shift[k]:
+            out[..., 0] = np.roll(out[..., 0], shift[k], axis=1)
+            out[..., 2] = np.roll(out[..., 2], -shift[k], axis=1)
+        if glitch[k]:
+            for _ in range(rng.integers(2, 5)):
+                y = rng.integers(0, h - 40)
+                band = slice(y, y + rng.integers(6, 40))
+                out[band] = np.roll(out[band], rng.integers(-48, 48), axis=1)
+        yield out
+
+def encode_frames(frames, out_path, size=(720, 1280), fps=None):
+    """Pipe raw rgb24 frames straight into an ffmpeg encode (draft settings; the edit re-encodes)."""
+    fps = fps or FPS
+    cmd = [ffmpeg_bin(), "-hide_banner", "-loglevel", "error", "-y",
+           "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{size[0]}x{size[1]}", "-r", str(fps), "-i", "pipe:0",
+           "-c:v", "libx264", "-preset", "ultrafast", "-crf", "18", "-pix_fmt", "yuv420p", out_path]
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        for frame in frames:
+            proc.stdin.write(frame.tobytes())
+    finally:
+        proc.stdin.close()
+        stderr = proc.stderr.read().decode("utf-8", errors="replace")
+        proc.wait()
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed ({proc.returncode}): {stderr.strip()[-2000:]}")
+    return out_path
+
+@tracer.traced("video.procedural")
+def procedural_hook(image_path, out_path, duration=HOOK_MOTION_SECONDS, seed=None):
+    """Fake-motion hook clip from a still. Returns None (still-image fallback) on failure."""
+    try:
+        buffer = load_prepared(image_path, PREP_ZOOM)
+        if buffer is None:
+            buffer = load_still(image_path, PREP_SIZE)
+        encode_frames(procedural_motion_frames(buffer, duration, seed=seed), out_path)
+        print(f"   🌀 Procedural hook ready: {out_path}")
+        return out_path
+    except Exception as e:
+        print(f"⚠️ Procedural hook failed: {e}")
+        return None
+
+# --- 4. EDITOR (Viral Engine) ---
+RENDER_BACKEND = os.environ.get("RENDER_BACKEND", "moviepy") # "moviepy" or "ffmpeg"
+FPS = 24
+MAX_DURATION = 59.0 # STRICT SHORTS LIMIT: 59 seconds max to be safe.
+
+# x264 encode profiles. Every backend encodes with one of these.
+ENCODE_PROFILES = {
+    # Intermediate that Submagic/Creatomate re-encode anyway: fastest preset, low CRF so
+    # the second encode starts from a clean source
+    "draft": {"preset": "ultrafast", "crf": 18, "params": [], "audio_bitrate": "192k", "audio_fps": 44100},
+    # YouTube Shorts ingest: High profile, 2 B-frames, closed GOP of half the frame rate, 48 kHz AAC
+    "final": {"preset": "slow", "crf": 20, "params": ["-profile:v", "high", "-bf", "2", "-g", str(FPS // 2), "-flags", "+cgop"],
+              "audio_bitrate": "192k", "audio_fps": 48000},
+}
+ENCODE_PROFILE = os.environ.get("ENCODE_PROFILE", "auto") # "auto": draft if the video goes to Submagic next, else final
+ENCODE_THREADS = int(os.environ.get("ENCODE_THREADS", "0")) # 0 lets x264 pick
+
+def caption_service_configured():
+    return bool(os.environ.get("SUBMAGIC_API_KEY") or os.environ.get("CREATOMATE_API_KEY"))
+
+def encode_profile(name=None):
+    name = name or ENCODE_PROFILE
+    if name == "auto":
+        # Draft only when a caption service is actually going to re-encode the edit
+        name = "draft" if CAPTIONS != "local" and caption_service_configured() else "final"
+    return dict(ENCODE_PROFILES[name], name=name)
+
+def x264_params(profile):
+    """Codec options shared by moviepy's ffmpeg_params and the ffmpeg backend's command line."""
+    params = ["-crf", str(profile["crf"]), "-pix_fmt", "yuv420p"] + profile["params"]
+    if ENCODE_THREADS:
+        params += ["-threads", str(ENCODE_THREADS)]
+    return params
+
+# Ken Burns effects as (start zoom, zoom per second)
+KEN_BURNS = {
+    'zoom_in': (1.0, 0.05),
+    'zoom_out': (1.2, -0.05),
+    'pan': (1.0, 0.0),
+}
+
+def load_still(path, size):
+    """Decode an image once and cover-fit it to exactly `size` (w, h): resize, then center crop."""
+    w, h = size
+    with PIL.Image.open(path) as img:
+        img = img.convert("RGB")
+        scale = max(w / img.width, h / img.height)
+        img = img.resize((max(w, round(img.width * scale)), max(h, round(img.height * scale))), PIL.Image.LANCZOS)
+        left = (img.width - w) // 2
+        top = (img.height - h) // 2
+        return np.asarray(img.crop((left, top, left + w, top + h)), dtype=np.uint8)
+
+# Prepared stills are the 720x1280 frame scaled by the deepest zoom they will be shown at,
+# so a Ken Burns crop never upscales the buffer. PREP_ZOOM is the floor (zoom_out's start).
+PREP_ZOOM = 1.2
+
+def ken_burns_zoom(duration, effect=None):
+    """Deepest zoom a Ken Burns shot of `duration` reaches (over every effect if None)."""
+    effects = [effect] if effect else list(KEN_BURNS)
+    return max(max(1.0, z0, z0 + rate * duration) for z0, rate in (KEN_BURNS[e] for e in effects))
+
+def prep_size(zoom=PREP_ZOOM, size=(720, 1280)):
+    """Working size that covers `zoom`, rounded up to a 0.1 step (and even dimensions)."""
+    z = max(PREP_ZOOM, math.ceil(round(zoom * 10, 6)) / 10)
+    return (2 * math.ceil(size[0] * z / 2), 2 * math.ceil(size[1] * z / 2))
+
+PREP_SIZE = prep_size()
+
+def prepared_path(image_path, size=PREP_SIZE):
+    return f"{image_path}.{size[0]}x{size[1]}.rgb"
+
+def find_prepared(image_path, zoom=1.0, size=(720, 1280)):
+    """The smallest prepared frame of a still that shows `zoom` without upscaling, as
+    (path, (w, h)), or None."""
+    best = None
+    for path in glob.glob(glob.escape(image_path) + ".*x*.rgb"):
+        m = re.fullmatch(r"(\d+)x(\d+)", path[len(image_path) + 1:-len(".rgb")])
+        if not m:
+            continue
+        w, h = int(m[1]), int(m[2])
+        if w + 1 >= size[0] * zoom and h + 1 >= size[1] * zoom and (best is None or w < best[1][0]):
+            best = (path, (w, h))
+    return best
+
+def load_prepared(image_path, zoom=1.0):
+    """The raw frame written by prepare_still() that covers `zoom`, or None if there isn't one."""
+    found = find_prepared(image_path, zoom)
+    if found is None:
+        return None
+    path, (w, h) = found
+    return np.fromfile(path, dtype=np.uint8).reshape(h, w, 3)
+
+@tracer.traced("image.prepare")
+def prepare_still(image_path, size=PREP_SIZE):
+    """Decode, cover-fit and center-crop a still to the working size once, as soon as it
+    arrives, and store it as raw rgb24. Rendering then starts from a ready-made buffer.
+    A still that can't be prepared is left for the renderer to decode itself."""
+    try:
+        frame = load_still(image_path, size)
+    except Exception as e:
+        print(f"   ⚠️ Could not prepare {image_path}: {e}")
+        return None
+    path = prepared_path(image_path, size)
+    tmp = path + ".tmp"
+    frame.tofile(tmp)
+    os.replace(tmp, path)
+    return path
+
+class KenBurnsFrames:
+    """Frame source replacing ImageClip(...).resize(height=1280).crop(...).resize(lambda t: zoom).
+
+    The still comes from a prepared raw frame when one is large enough for the shot's
+    deepest zoom; otherwise it is decoded and scaled once to size * max zoom. Every frame's
+    centered crop window is precomputed as bilinear row/column taps, so a frame is a few
+    NumPy gathers and blends from that buffer instead of a PIL resize. A shot with a
+    constant zoom is resampled once, with LANCZOS.
+    """
+
+    def __init__(self, image_path, duration, effect='pan', size=(720, 1280), fps=FPS):
+        w, h = size
+        z0, rate = KEN_BURNS[effect]
+        n = int(math.ceil(duration * fps)) + 1
+        # Zooming out below 1.0 would expose the background, so hold at 1.0
+        zooms = np.maximum(1.0, z0 + rate * np.arange(n) / fps)
+        scale = float(zooms.max())
+        self.buffer = load_prepared(image_path, scale)
+        if self.buffer is None:
+            self.buffer = load_still(image_path, (int(math.ceil(w * scale)), int(math.ceil(h * scale))))
+        bh, bw = self.buffer.shape[:2]
+        self._fps = fps
+        self._static = None
+
+        win_w = bw / zooms
+        win_h = bh / zooms
+        x0 = (bw - win_w) / 2
+        y0 = (bh - win_h) / 2
+        if np.all(zooms == zooms[0]):
+            if (bw, bh) == (w, h):
+                self._static = self.buffer
+            else:
+                box = (x0[0], y0[0], x0[0] + win_w[0], y0[0] + win_h[0])
+                self._static = np.asarray(PIL.Image.fromarray(self.buffer).resize((w, h), PIL.Image.LANCZOS, box=box))
+        else:
+            self._src = self.buffer.astype(np.int16).reshape(bh, bw * 3)
+            self._rows = _taps(y0, win_h / h, h, bh)
+            self._cols = _taps(x0, win_w / w, w, bw, channels=3)
+            self._rowbufs = (np.empty((h, bw * 3), dtype=np.int16), np.empty((h, bw * 3), dtype=np.int16))
+            self._outbufs = (np.empty((h, w * 3), dtype=np.int16), np.empty((h, w * 3), dtype=np.int16))
+
+    def __call__(self, t):
+        if self._static is not None:
+            return self._static
+        return self._gather(min(int(round(t * self._fps)), len(self._rows[0]) - 1))
+
+    def _gather(self, k):
+        rows = tuple(v[k] for v in self._rows)
+        cols = tuple(v[k] for v in self._cols)
+        h, w3 = self._outbufs[0].shape
+        return _bilinear(self._src, rows, cols, self._rowbufs, self._outbufs).astype(np.uint8).reshape(h, w3 // 3, 3)
+
+def ken_burns_clip(image_path, duration, effect='pan', size=(720, 1280), fps=FPS):
+    from moviepy.editor import VideoClip
+    return VideoClip(make_frame=KenBurnsFrames(image_path, duration, effect, size, fps), duration=duration)
+
+# --- 4.0. TEXT LAYERS (Pillow) ---
+# Text is rasterized in-process once and composited as a static layer; no ImageMagick.
+HOOK_FONT_FILE = os.environ.get("HOOK_FONT_FILE", "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf")
+
+@functools.lru_cache(maxsize=None)
+def load_font(path, size):
+    """FreeType faces are parsed once per (file, size) and reused by every layer and caption."""
+    try:
+        return PIL.ImageFont.truetype(path, size)
+    except OSError:
+        return PIL.ImageFont.load_default(size=size)
+
+@functools.lru_cache(maxsize=32)
+def text_layer(text, size=(720, 1280), fontsize=70, max_width=600):
+    """Transparent RGBA layer with the text centered: white, black stroke, wrapped to max_width.
+    Cached, so callers must treat the returned image as read-only."""
+    font = load_font(HOOK_FONT_FILE, fontsize)
+    lines, line = [], ""
+    for word in text.split():
+        candidate = f"{line} {word}".strip()
+        if line and font.getlength(candidate) > max_width:
+            lines.append(line)
+            line = word
+        else:
+            line = candidate
+    if line:
+        lines.append(line)
+
+    layer = PIL.Image.new("RGBA", size, (0, 0, 0, 0))
+    PIL.ImageDraw.Draw(layer).multiline_text(
+        (size[0] / 2, size[1] / 2), "\n".join(lines), font=font, fill="white",
+        anchor="mm", align="center", stroke_width=2, stroke_fill="black"
+    )
+    return layer
+
+def render_text_layer(text, path, size=(720, 1280), fontsize=70, max_width=600):
+    """text_layer() saved as a PNG (for the ffmpeg backend)."""
+    text_layer(text, size, fontsize, max_width).save(path)
+    return path
+
+def text_overlay_clip(text, duration, size=(720, 1280)):
+    """text_layer() as a static moviepy clip, cropped to the text's bounding box so only
+    those pixels are blended per frame. None if there is nothing to draw."""
+    layer = text_layer(text, size)
+    box = layer.getbbox()
+    if box is None:
+        return None
+    from moviepy.editor import ImageClip
+    rgba = np.asarray(layer.crop(box))
+    mask = ImageClip(rgba[..., 3] / 255.0, ismask=True)
+    return ImageClip(rgba[..., :3]).set_mask(mask).set_duration(duration).set_position(box[:2])
+
+def build_hook_clip(hook_video_path, hook_duration, hook_text):
+    from moviepy.editor import VideoFileClip, CompositeVideoClip, concatenate_videoclips
+    # Visual Hook: Wan 2.2 generated video OR fallback image
+    # Determine if video or image
+    if hook_video_path.lower().endswith(('.mp4', '.mov', '.avi')):
+        video_clip = VideoFileClip(hook_video_path, audio=False).resize(height=1280)
+        # Center crop to 720x1280
+        if video_clip.w > 720:
+             video_clip = video_clip.crop(x1=video_clip.w/2 - 360, width=720)
+        
+        # Logic: If Audio > Video, freeze the last frame. If Audio < Video, cut video.
+        if hook_duration > video_clip.duration:
+            # Freeze frame extension
+            freeze_duration = hook_duration - video_clip.duration
+            frozen_frame = video_clip.to_ImageClip(t=video_clip.duration - 0.1).set_duration(freeze_duration)
+            hook_clip = concatenate_videoclips([video_clip, frozen_frame])
+        else:
+            hook_clip = video_clip.subclip(0, hook_duration)
+            
+    else:
+        # Fallback to ImageClip if it's a jpg/png
+        # Apply subtle zoom to static hook
+        hook_clip = ken_burns_clip(hook_video_path, hook_duration, 'zoom_in')
+    
+    # Text Hook: Overlay
+    txt_clip = text_overlay_clip(hook_text or "", hook_duration)
+    if txt_clip is not None:
+        hook_clip = CompositeVideoClip([hook_clip, txt_clip])
+    return hook_clip
+
+def build_segment_clip(segment):
+    """Timeline entries are ("hook", path, duration, text) or ("still", path, duration, effect)."""
+    kind, path, duration, extra = segment
+    if kind == "hook":
+        return build_hook_clip(path, duration, extra)
+    return ken_burns_clip(path, duration, extra)
+
+def with_captions(clip, words, offset=0.0):
+    """Overlay the caption cues that fall inside [offset, offset + clip.duration)."""
+    if not words:
+        return clip
+    from moviepy.editor import CompositeVideoClip
+    captions = caption_clip(words, clip.duration, offset).set_position(("center", CAPTION_Y))
+    return CompositeVideoClip([clip, captions])
+
+@tracer.traced("edit.render")
+def create_viral_short(hook_video_path, body_image_paths, hook_audio_path, body_audio_path, hook_text, output_filename, backend=None, workers=None, captions=None, profile=None):
+    """captions: burn in the word timings stored next to the audio files (default: CAPTIONS == "local").
+    profile: an ENCODE_PROFILES name (default: ENCODE_PROFILE)."""
+    if captions is None:
+        captions = CAPTIONS == "local"
+    profile = encode_profile(profile)
+    print(f"   🎛️ Encode profile: {profile['name']} (preset={profile['preset']}, crf={profile['crf']})")
+    if (backend or RENDER_BACKEND) == "ffmpeg":
+        return render_ffmpeg(hook_video_path, body_image_paths, hook_audio_path, body_audio_path, hook_text, output_filename, captions, profile)
+
+    print("✂️ Editing Viral Short (Smart Sync)...")
+    from moviepy.editor import concatenate_videoclips
+
+    # Decode, join and normalize the voiceover once; it is piped to the encoder as PCM
+    rate = profile["audio_fps"]
+    pcm, hook_duration, body_duration = mix_voiceover(hook_audio_path, body_audio_path, rate)
+
+    segments = []
+
+    # --- 1. THE HOOK (Synced to Audio) ---
+    
+    if os.path.exists(hook_video_path):
+        segments.append(("hook", hook_video_path, hook_duration, hook_text))
+    else:
+        # Emergency fallback if no hook media?
+        # Just use black screen? Or skip.
+        pass
+
+    # --- 2. THE BODY (Synced to Body Audio) ---
+    if body_duration > 0 and body_image_paths:
+        # The body audio that fits under the limit, split across the planned shots
+        shots = shot_durations(hook_duration, body_duration, len(body_image_paths))
+        for img_path, duration in zip(body_image_paths, shots):
+            if not os.path.exists(img_path): continue
+            # "Ken Burns" (Zoom/Pan)
+            effect = random.choice(list(KEN_BURNS))
+            segments.append(("still", img_path, duration, effect))
+
+    # Drop/trim whatever would land past the Shorts limit before rendering it
+    timeline, start = [], 0.0
+    for kind, path, duration, extra in segments:
+        if start >= MAX_DURATION:
+            break
+        duration = min(duration, MAX_DURATION - start)
+        timeline.append((kind, path, duration, extra))
+        start += duration
+    
+    # Ensure exact duration match
+    final_duration = min(start, len(pcm) / rate, MAX_DURATION)
+    words = caption_timeline(hook_audio_path, body_audio_path, hook_duration, final_duration) if captions else []
+
+    workers = workers or RENDER_WORKERS
+    if workers > 1 and len(timeline) > 1:
+        return render_segments_parallel(timeline, pcm, final_duration, output_filename, workers, words, profile)
+
+    # Concatenate all visual clips (Hook + Body Images)
+    clips = [build_segment_clip(segment) for segment in timeline]
+    final_video = concatenate_videoclips(clips, method="compose")
+    final_video = with_captions(final_video, words)
+    final_video = final_video.set_duration(final_duration)
+
+    encode_av(final_video.iter_frames(fps=FPS, dtype="uint8"), pcm, rate, output_filename, profile,
+              size=final_video.size, duration=final_duration)
+    final_video.close()
+    return output_filename
+
+# --- 4.1. EDITOR (Parallel Segments) ---
+# Each timeline entry is encoded in its own process with identical settings, then the
+# segments are joined with a stream-copy concat and the audio is muxed once.
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", "1"))
+SEGMENT_FFMPEG_PARAMS = ["-pix_fmt", "yuv420p", "-video_track_timescale", str(FPS * 512)]
+
+def _render_segment(segment, out_path, words=None, offset=0.0, profile=None, ffmpeg_params=None):
+    """Runs in a forkserver worker, which imports this module afresh: settings changed after
+    import (--encode-threads, say) must come in as arguments, like ffmpeg_params."""
+    profile = profile or encode_profile()
+    clip = with_captions(build_segment_clip(segment), words, offset)
+    if ffmpeg_params is None:
+        ffmpeg_params = x264_params(profile) + SEGMENT_FFMPEG_PARAMS
+    clip.write_videofile(out_path, fps=FPS, codec='libx264', audio=False, preset=profile["preset"],
+                         ffmpeg_params=ffmpeg_params, logger=None)
+    clip.close()
+    return out_path
+
+def render_segments_parallel(timeline, pcm, final_duration, output_filename, workers, words=None, profile=None):
+    """pcm: mix_voiceover() output at profile["audio_fps"], muxed from stdin."""
+    profile = profile or encode_profile()
+    print(f"   🧩 Rendering {len(timeline)} segments on {workers} processes...")
+    seg_dir = output_filename + ".segments"
+    os.makedirs(seg_dir, exist_ok=True)
+    try:
+        paths = [os.path.abspath(os.path.join(seg_dir, f"seg_{i:03d}.mp4")) for i in range(len(timeline))]
+        # Each segment burns in its own slice of the captions
+        offsets = list(np.cumsum([0.0] + [seg[2] for seg in timeline[:-1]]))
+        # Not fork: this process has DAG, hedge and tracer threads whose locks a forked child could inherit held
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("forkserver")) as pool:
+            n = len(timeline)
+            params = x264_params(profile) + SEGMENT_FFMPEG_PARAMS
+            list(pool.map(_render_segment, timeline, paths, [words] * n, offsets, [profile] * n, [params] * n))
+
+        list_file = os.path.join(seg_dir, "concat.txt")
+        with open(list_file, "w") as f:
+            for p in paths:
+                f.write("file '" + p.replace("'", "'\\''") + "'\n")
+
+        rate = profile["audio_fps"]
+        run_ffmpeg([
+            "-f", "concat", "-safe", "0", "-i", list_file,
+            *pcm_input(rate),
+            "-map", "0:v", "-map", "1:a", "-c:v", "copy",
+            "-c:a", "aac", "-b:a", profile["audio_bitrate"], "-ar", str(rate), "-ac", "2",
+            "-t", f"{final_duration:.3f}", "-movflags", "+faststart",
+            output_filename,
+        ], input=pcm.tobytes())
+    finally:
+        shutil.rmtree(seg_dir, ignore_errors=True)
+    return output_filename
+
+# --- 4.2. AUDIO (In-Memory Mix + Loudness) ---
+# The TTS files are decoded once to float PCM, joined (and optionally laid over a bed) in
+# NumPy, normalized to YouTube's loudness target and fed to the encoder over a pipe.
+LOUDNESS_TARGET = float(os.environ.get("LOUDNESS_TARGET", "-14")) # LUFS; YouTube turns louder uploads down to this
+PEAK_CEILING = -1.0 # dBFS
+MAX_LIMITING = 6.0 # dB of peaks the soft limiter may absorb to reach the target
+AUDIO_BED = os.environ.get("AUDIO_BED", "") # "" (voice only), "drone" (synthesized) or a path to a loop/SFX file
+AUDIO_BED_DB = float(os.environ.get("AUDIO_BED_DB", "-20")) # Bed level relative to the voice (RMS)
+
+def decode_audio(path, rate):
+    """Any audio file as mono float32 PCM at `rate`."""
+    raw = run_ffmpeg(["-i", path, "-vn", "-f", "f32le", "-ac", "1", "-ar", str(rate), "pipe:1"])
+    return np.frombuffer(raw, dtype=np.float32)
+
+def pcm_input(rate, pipe="pipe:0"):
+    """ffmpeg input args for mix_voiceover() output written to `pipe`."""
+    return ["-f", "f32le", "-ar", str(rate), "-ac", "1", "-i", pipe]
+
+def _biquad(b, a, z):
+    return (b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)
+
+def k_weighting(freqs, rate):
+    """|H(f)| of the ITU-R BS.1770 K-weighting filter (high shelf, then high pass) at `rate`."""
+    z = np.exp(-2j * np.pi * freqs / rate)
+    k = math.tan(math.pi * 1681.974450955532 / rate)
+    q = 0.7071752369554193
+    vh = 10 ** (3.99984385397 / 20)
+    vb = vh ** 0.499666774155
+    a0 = 1 + k / q + k * k
+    shelf = _biquad([(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0],
+                    [1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0], z)
+    k = math.tan(math.pi * 38.13547087613982 / rate)
+    q = 0.5003270373253953
+    a0 = 1 + k / q + k * k
+    highpass = _biquad([1.0, -2.0, 1.0], [1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0], z)
+    return np.abs(shelf * highpass)
+
+def integrated_loudness(pcm, rate):
+    """BS.1770 integrated loudness (LUFS) of mono PCM: K-weighted (applied in the frequency
+    domain), 400 ms blocks with 75% overlap, -70 LUFS absolute and -10 LU relative gates."""
+    n = len(pcm)
+    if n == 0:
+        return -math.inf
+    size = 1 << (n - 1).bit_length()
+    spectrum = np.fft.rfft(pcm, size) * k_weighting(np.fft.rfftfreq(size, 1 / rate), rate)
+    weighted = np.fft.irfft(spectrum, size)[:n]
+    energy = np.concatenate(([0.0], np.cumsum(weighted * weighted)))
+    block = min(n, int(0.4 * rate))
+    starts = np.arange(0, n - block + 1, max(1, block // 4))
+    power = (energy[starts + block] - energy[starts]) / block
+    power = power[power > 10 ** ((-70 + 0.691) / 10)]
+    if len(power) == 0:
+        return -math.inf
+    power = power[power > power.mean() * 0.1]
+    return -0.691 + 10 * math.log10(power.mean())
+
+def soft_limit(pcm, ceiling_db=PEAK_CEILING, knee_db=3.0):
+    """Pass samples below the knee untouched and bend the rest smoothly under the ceiling."""
+    ceiling = 10 ** (ceiling_db / 20)
+    knee = 10 ** ((ceiling_db - knee_db) / 20)
+    mag = np.abs(pcm)
+    over = mag > knee
+    if not over.any():
+        return pcm
+    out = pcm.copy()
+    span = ceiling - knee
+    out[over] = np.sign(pcm[over]) * (knee + span * np.tanh((mag[over] - knee) / span))
+    return out
+
+def normalize_loudness(pcm, rate, target=None):
+    target = LOUDNESS_TARGET if target is None else target
+    loudness = integrated_loudness(pcm, rate)
+    peak = float(np.abs(pcm).max(initial=0.0))
+    if not math.isfinite(loudness) or peak == 0:
+        return pcm
+    # Loud enough TTS only needs gain; quiet TTS may have its top few dB of peaks limited
+    gain_db = min(target - loudness, PEAK_CEILING + MAX_LIMITING - 20 * math.log10(peak))
+    print(f"   🔊 Loudness: {loudness:.1f} LUFS, {gain_db:+.1f} dB (target {target:.0f})")
+    return soft_limit(pcm * np.float32(10 ** (gain_db / 20)))
+
+def drone_bed(n, rate, seed=None):
+    """Low detuned sines with slow swells over brown noise: a generic horror room tone."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(n, dtype=np.float32) / rate
+    root = rng.uniform(41.0, 55.0)
+    bed = np.zeros(n, dtype=np.float32)
+    for ratio, level in ((1.0, 1.0), (1.5, 0.5), (2.02, 0.35), (2.99, 0.15)):
+        swell = 0.6 + 0.4 * np.sin(2 * np.pi * rng.uniform(0.03, 0.12) * t + rng.uniform(0, 2 * np.pi))
+        bed += level * swell * np.sin(2 * np.pi * root * ratio * t + rng.uniform(0, 2 * np.pi))
+    # Brown-ish rumble: white noise shaped to 1/f below 400 Hz in the frequency domain
+    freqs = np.fft.rfftfreq(n, 1 / rate)
+    shape = np.where(freqs < 400, 1.0 / np.maximum(freqs, 20.0), 0.0)
+    noise = np.fft.irfft(np.fft.rfft(rng.standard_normal(n)) * shape, n).astype(np.float32)
+    bed += 0.5 * noise / (np.abs(noise).max() or 1.0)
+    return bed
+
+def load_bed(spec, n, rate):
+    """AUDIO_BED as n samples: synthesized, or the file decoded once and looped."""
+    if spec == "drone":
+        return drone_bed(n, rate)
+    loop = decode_audio(spec, rate)
+    if len(loop) == 0:
+        return np.zeros(n, dtype=np.float32)
+    return np.resize(loop, n)
+
+def _rms(pcm):
+    return float(np.sqrt(np.mean(np.square(pcm, dtype=np.float64)))) if len(pcm) else 0.0
+
+@tracer.traced("audio.mix")
+def mix_voiceover(hook_audio_path, body_audio_path, rate, limit=MAX_DURATION, bed=None):
+    """Hook + body voiceover as one normalized mono float32 buffer, cut at `limit` seconds.
+    Returns (pcm, hook_duration, body_duration); durations are of the untrimmed TTS files."""
+    bed = AUDIO_BED if bed is None else bed
+    hook = decode_audio(hook_audio_path, rate)
+    body = decode_audio(body_audio_path, rate)
+    pcm = np.concatenate([hook, body])[:int(limit * rate)]
+    if bed and len(pcm):
+        layer = load_bed(bed, len(pcm), rate)
+        fade = min(len(layer) // 2, rate) # 1 s fade in/out
+        ramp = np.linspace(0.0, 1.0, fade, dtype=np.float32)
+        layer[:fade] *= ramp
+        layer[len(layer) - fade:] *= ramp[::-1]
+        scale = _rms(pcm) * 10 ** (AUDIO_BED_DB / 20) / (_rms(layer) or 1.0)
+        pcm = pcm + np.float32(scale) * layer
+        print(f"   🎚️ Mixed audio bed: {bed} ({AUDIO_BED_DB:.0f} dB under the voice)")
+    if len(pcm) < len(hook) + len(body):
+        # Cut at the Shorts limit: short fade instead of a click
+        fade = min(len(pcm), rate // 20)
+        pcm = pcm.copy()
+        pcm[len(pcm) - fade:] *= np.linspace(1.0, 0.0, fade, dtype=np.float32)
+    pcm = normalize_loudness(pcm, rate)
+    return np.ascontiguousarray(pcm, dtype=np.float32), len(hook) / rate, len(body) / rate
+
+def encode_av(frames, pcm, rate, out_path, profile, size=(720, 1280), duration=None):
+    """Encode raw rgb24 frames (stdin) and mix_voiceover() PCM (a second pipe, fed from a
+    thread) in one ffmpeg process: no temp audio file and no separate mux."""
+    read_fd, write_fd = os.pipe()
+    cmd = [ffmpeg_bin(), "-hide_banner", "-loglevel", "error", "-y",
+           "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{size[0]}x{size[1]}", "-r", str(FPS), "-i", "pipe:0",
+           *pcm_input(rate, f"pipe:{read_fd}"),
+           "-map", "0:v", "-map", "1:a"]
+    if duration:
+        cmd += ["-t", f"{duration:.3f}"]
+    cmd += ["-c:v", "libx264", "-preset", profile["preset"], *x264_params(profile),
+            "-c:a", "aac", "-b:a", profile["audio_bitrate"], "-ar", str(rate), "-ac", "2",
+            "-movflags", "+faststart", out_path]
+    try:
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE, pass_fds=(read_fd,))
+    except Exception:
+        os.close(write_fd)
+        raise
+    finally:
+        os.close(read_fd)
+
+    def feed_audio():
+        with open(write_fd, "wb") as f:
+            try:
+                f.write(pcm.tobytes())
+            except BrokenPipeError:
+                pass # ffmpeg stopped reading (-t); the frame loop reports real failures
+
+    feeder = threading.Thread(target=feed_audio, daemon=True)
+    feeder.start()
+    try:
+        for frame in frames:
+            proc.stdin.write(frame.tobytes())
+    except BrokenPipeError:
+        pass
+    finally:
+        try:
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        stderr = proc.stderr.read().decode("utf-8", errors="replace")
+        proc.wait()
+        feeder.join()
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed ({proc.returncode}): {stderr.strip()[-2000:]}")
+    return out_path
+
+# --- 4.3. SCENE PLANNER (Shot Budget) ---
+# How many body images a short can actually show is decided from the voiceover length
+# before any image is paid for: shots that would land past MAX_DURATION, or be on screen
+# for less than MIN_SHOT_SECONDS, are never generated.
+SCENE_PLAN = os.environ.get("SCENE_PLAN", "estimate") # "estimate" from the script, or "tts": synthesize the audio first
+SPEECH_RATE = float(os.environ.get("SPEECH_RATE", "2.6")) # Words per second of the TTS voices (~155 wpm)
+MIN_SHOT_SECONDS = float(os.environ.get("MIN_SHOT_SECONDS", "2.0"))
+
+def estimate_speech_duration(text):
+    words = len(text.split())
+    return words / SPEECH_RATE + (0.3 if words else 0.0) # Leading/trailing silence
+
+def shot_durations(hook_duration, body_duration, count):
+    """Split the part of the body audio that fits under MAX_DURATION evenly across `count` shots."""
+    visible = max(0.0, min(body_duration, MAX_DURATION - hook_duration))
+    if count <= 0 or visible <= 0:
+        return []
+    return [visible / count] * count
+
+def plan_scenes(prompts, hook_duration, body_duration):
+    """Pick which visual prompts to generate and how long each shot lasts. Every shot gets at
+    least MIN_SHOT_SECONDS (but there is always one shot while body audio is visible); the
+    prompts kept are spread evenly over the list, so the story's arc survives the cut."""
+    visible = max(0.0, min(body_duration, MAX_DURATION - hook_duration))
+    count = min(len(prompts), max(1, int(visible // MIN_SHOT_SECONDS))) if visible > 0 else 0
+    keep = sorted({round(i * (len(prompts) - 1) / max(1, count - 1)) for i in range(count)})
+    return {
+        "prompts": [prompts[i] for i in keep],
+        "shots": [round(d, 3) for d in shot_durations(hook_duration, body_duration, count)],
+        "hook_duration": round(hook_duration, 3),
+        "body_duration": round(body_duration, 3),
+        "dropped": len(prompts) - len(keep),
+    }
+
+# --- 4.5. EDITOR (ffmpeg Backend) ---
+# Same timeline as create_viral_short, compiled into one filtergraph and encoded in a single pass.
+@functools.lru_cache(maxsize=None)
+def ffmpeg_bin():
+    """Same binary moviepy uses (FFMPEG_BINARY env or the imageio-ffmpeg download)."""
+    from moviepy.config import get_setting
+    return get_setting("FFMPEG_BINARY")
+
+def probe_duration(path):
+    from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+    return ffmpeg_parse_infos(path)["duration"]
+
+def still_input(path, zoom=1.0):
+    """ffmpeg input args for a still: a prepared raw frame that covers `zoom`, else the file."""
+    found = find_prepared(path, zoom)
+    if found:
+        prepared, (w, h) = found
+        return ("-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{w}x{h}", "-i", prepared)
+    return ("-i", path)
+
+def _zoompan(effect, duration, size="720x1280"):
+    z0, rate = KEN_BURNS[effect]
+    frames = max(1, round(duration * FPS))
+    # Upscale first so the integer crop window of zoompan doesn't jitter
+    return (
+        f"scale=1440:2560:force_original_aspect_ratio=increase,crop=1440:2560,"
+        f"zoompan=z='{z0}{rate:+g}*on/{FPS}':d={frames}:s={size}:fps={FPS}"
+        f":x='iw/2-(iw/zoom/2)':y='ih/2-(ih/zoom/2)'"
+    )
+
+def reencode(src, dst, profile=None):
+    """Re-encode a finished short with another profile (a draft edit nobody captioned)."""
+    profile = profile or encode_profile("final")
+    run_ffmpeg(["-i", src, "-c:v", "libx264", "-preset", profile["preset"], *x264_params(profile),
+                "-c:a", "aac", "-b:a", profile["audio_bitrate"], "-ar", str(profile["audio_fps"]),
+                "-movflags", "+faststart", dst])
+    return dst
+
+def run_ffmpeg(args, input=None):
+    """Run ffmpeg; `input` bytes are fed to stdin (for "-i pipe:0"). Returns stdout (for "pipe:1")."""
+    cmd = [ffmpeg_bin(), "-hide_banner", "-loglevel", "error", "-y"] + args
+    res = subprocess.run(cmd, input=input, capture_output=True)
+    if res.returncode != 0:
+        stderr = res.stderr.decode("utf-8", errors="replace").strip()
+        raise RuntimeError(f"ffmpeg failed ({res.returncode}): {stderr[-2000:]}")
+    return res.stdout
+
+def render_ffmpeg(hook_video_path, body_image_paths, hook_audio_path, body_audio_path, hook_text, output_filename, captions=False, profile=None):
+    profile = profile or encode_profile()
+    print("✂️ Editing Viral Short (ffmpeg single pass)...")
+    rate = profile["audio_fps"]
+    pcm, hook_duration, body_duration = mix_voiceover(hook_audio_path, body_audio_path, rate)
+
+    inputs, chains, segments = [], [], []
+
+    def add_input(*args):
+        inputs.extend(args)
+        return len([a for a in inputs if a == "-i"]) - 1
+
+    # --- 1. THE HOOK ---
+    if os.path.exists(hook_video_path):
+        if hook_video_path.lower().endswith(('.mp4', '.mov', '.avi')):
+            idx = add_input("-i", hook_video_path)
+            # Freeze the last frame if the audio outlasts the clip, then cut to the audio
+            chains.append(
+                f"[{idx}:v]scale=720:1280:force_original_aspect_ratio=increase,crop=720:1280,fps={FPS},"
+                f"tpad=stop_mode=clone:stop_duration={hook_duration:.3f},trim=duration={hook_duration:.3f},"
+                f"setpts=PTS-STARTPTS,setsar=1,format=yuv420p[hook]"
+            )
+        else:
+            idx = add_input(*still_input(hook_video_path, ken_burns_zoom(hook_duration, 'zoom_in')))
+            chains.append(f"[{idx}:v]{_zoompan('zoom_in', hook_duration)},setsar=1,format=yuv420p[hook]")
+
+        # Text Hook: Overlay (rasterized with Pillow; not every ffmpeg build has drawtext)
+        label = "hook"
+        if hook_text:
+            text_png = output_filename + ".hook.png"
+            render_text_layer(hook_text, text_png)
+            txt = add_input("-i", text_png)
+            chains.append(f"[hook][{txt}:v]overlay=0:0:format=auto,format=yuv420p[hooktxt]")
+            label = "hooktxt"
+        segments.append(f"[{label}]")
+
+    # --- 2. THE BODY ---
+    if body_duration > 0 and body_image_paths:
+        shots = shot_durations(hook_duration, body_duration, len(body_image_paths))
+        for i, (img_path, duration) in enumerate(zip(body_image_paths, shots)):
+            if not os.path.exists(img_path): continue
+            effect = random.choice(list(KEN_BURNS))
+            idx = add_input(*still_input(img_path, ken_burns_zoom(duration, effect)))
+            chains.append(f"[{idx}:v]{_zoompan(effect, duration)},setsar=1,format=yuv420p[b{i}]")
+            segments.append(f"[b{i}]")
+
+    if not segments:
+        raise ValueError("Nothing to render: no hook media and no body images")
+
+    # --- 3. CONCAT + AUDIO ---
+    audio = add_input(*pcm_input(rate))
+    chains.append(f"{''.join(segments)}concat=n={len(segments)}:v=1:a=0[v]")
+
+    final_duration = min(hook_duration + body_duration, MAX_DURATION)
+    caption_dir = output_filename + ".captions"
+    video_out = "[v]"
+    words = caption_timeline(hook_audio_path, body_audio_path, hook_duration, final_duration) if captions else []
+    if words:
+        # All cues become one PNG slideshow input, overlaid in the same encode
+        track = write_caption_track(words, final_duration, caption_dir)
+        cap = add_input("-f", "concat", "-safe", "0", "-i", track)
+        chains.append(f"[v][{cap}:v]overlay=0:{CAPTION_Y}:eof_action=pass:format=auto,format=yuv420p[vc]")
+        video_out = "[vc]"
+
+    try:
+        run_ffmpeg(inputs + [
+            "-filter_complex", ";".join(chains),
+            "-map", video_out, "-map", f"{audio}:a",
+            "-t", f"{final_duration:.3f}",
+            "-r", str(FPS), "-c:v", "libx264", "-preset", profile["preset"], *x264_params(profile),
+            "-c:a", "aac", "-b:a", profile["audio_bitrate"], "-ar", str(rate), "-ac", "2", "-movflags", "+faststart",
+            output_filename,
+        ], input=pcm.tobytes())
+    finally:
+        if os.path.exists(output_filename + ".hook.png"):
+            os.remove(output_filename + ".hook.png")
+        shutil.rmtree(caption_dir, ignore_errors=True)
+    return output_filename
+
+# --- 4.6. CAPTIONS (Word Timings + Local Burn-In) ---
+# Word timings are saved next to each TTS file (<audio>.words.json) and burned in during
+# the edit, instead of round-tripping the finished video through Submagic/Creatomate.
+CAPTIONS = os.environ.get("CAPTIONS", "local") # "local" burns captions in; "submagic" uses Submagic -> Creatomate
+CAPTION_FONT_FILE = os.environ.get("CAPTION_FONT_FILE", HOOK_FONT_FILE)
+CAPTION_SIZE = (720, 260) # Caption band, overlaid at CAPTION_Y (clear of the Shorts UI at the bottom)
+CAPTION_Y = 860
+CAPTION_WORDS = 3 # Words on screen at once; the one being spoken is highlighted
+
+def words_path(audio_path):
+    return audio_path + ".words.json"
+
+def save_words(words, path):
+    with open(path, "w") as f:
+        json.dump(words, f)
+    return path
+
+def load_words(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+def estimate_word_timings(text, duration):
+    """For TTS engines without word boundaries: spread the words over the audio by length."""
+    words = text.split()
+    if not words or duration <= 0:
+        return []
+    weights = [len(w) + 1 for w in words] # +1 for the gap after each word
+    scale = duration / sum(weights)
+    timings, t = [], 0.0
+    for word, weight in zip(words, weights):
+        timings.append({"word": word, "start": round(t, 3), "end": round(t + (weight - 1) * scale, 3)})
+        t += weight * scale
+    return timings
+
+PHRASE_END = tuple(".,!?;:…")
+
+def voiced_frames(pcm, rate, gap=0.08):
+    """Per-10ms voiced flags: above -26 dB of the loudest frame, with dips shorter than `gap`
+    (stops inside words) filled in."""
+    hop = rate // 100
+    frames = len(pcm) // hop
+    rms = np.sqrt(np.mean(np.square(pcm[:frames * hop].reshape(frames, hop), dtype=np.float64), axis=1))
+    voiced = rms > max(rms.max(initial=0.0) * 0.05, 1e-4)
+    idx = np.flatnonzero(voiced)
+    if len(idx) < 2:
+        return voiced
+    # Fill every unvoiced run between two voiced frames that is shorter than the gap
+    starts = idx[:-1][np.diff(idx) > 1] + 1
+    ends = idx[1:][np.diff(idx) > 1]
+    for s, e in zip(starts, ends):
+        if e - s < gap * 100:
+            voiced[s:e] = True
+    return voiced
+
+def _spread(words, voiced, f0, f1):
+    """estimate_word_timings() over the voiced frames of [f0, f1) only."""
+    speech = np.cumsum(np.concatenate(([0], voiced[f0:f1])))
+    if speech[-1] == 0:
+        return [{"word": w, "start": f0 / 100.0, "end": f0 / 100.0} for w in words]
+    est = estimate_word_timings(" ".join(words), speech[-1] / 100.0)
+    # A start maps to the next voiced frame, an end to where the voicing it belongs to stops
+    starts = np.searchsorted(speech, [round(w["start"] * 100, 6) for w in est], side="right") - 1
+    ends = np.searchsorted(speech, [round(w["end"] * 100, 6) for w in est], side="left")
+    # ...and never runs on past the next pause
+    silent = np.flatnonzero(~voiced[f0:f1])
+    pause = silent[np.minimum(np.searchsorted(silent, starts), len(silent) - 1)] if len(silent) else ends
+    ends = np.where(pause > starts, np.minimum(ends, pause), ends)
+    return [{"word": w["word"], "start": round((f0 + int(s)) / 100.0, 3), "end": round((f0 + int(max(e, s))) / 100.0, 3)}
+            for w, s, e in zip(est, starts, ends)]
+
+def align_word_timings(text, audio_path, rate=16000, skip_cost=0.75):
+    """For TTS engines without word boundaries. Phrase breaks (punctuation) are anchored to
+    pauses in the audio, matched in order by nearest estimated time; words are then spread
+    by length over the voiced part of each phrase, so silences stay empty."""
+    words = text.split()
+    voiced = voiced_frames(decode_audio(audio_path, rate), rate)
+    if not words or not voiced.any():
+        return estimate_word_timings(text, len(voiced) / 100.0)
+
+    # Pauses: unvoiced runs between voiced frames, as (first, end) frame indices
+    edges = np.flatnonzero(np.diff(voiced.astype(np.int8)))
+    pauses = [(int(a) + 1, int(b) + 1) for a, b in zip(edges, edges[1:]) if not voiced[a + 1]]
+    breaks = [i for i, w in enumerate(words[:-1]) if w.endswith(PHRASE_END)]
+    first = _spread(words, voiced, 0, len(voiced))
+    guess = [first[i]["end"] for i in breaks]
+    mids = [(a + b) / 200.0 for a, b in pauses]
+
+    # Monotonic alignment of breaks to pauses; a pause may go unused, a break costs skip_cost
+    n, m = len(breaks), len(pauses)
+    cost = np.full((n + 1, m + 1), np.inf)
+    cost[0, :] = 0.0
+    move = {}
+    for j in range(1, n + 1):
+        cost[j, 0] = j * skip_cost
+        move[j, 0] = "skip"
+        for i in range(1, m + 1):
+            options = [(cost[j - 1, i] + skip_cost, "skip"), (cost[j, i - 1], "pause"),
+                       (cost[j - 1, i - 1] + abs(guess[j - 1] - mids[i - 1]), "match")]
+            cost[j, i], move[j, i] = min(options)
+    anchors, j, i = [], n, m
+    while j > 0:
+        step = move[j, i]
+        if step == "match":
+            anchors.append((breaks[j - 1] + 1, pauses[i - 1]))
+        if step != "pause":
+            j -= 1
+        if step != "skip":
+            i -= 1
+    anchors.reverse()
+
+    timings, w0, f0 = [], 0, 0
+    for w1, (p0, p1) in anchors + [(len(words), (len(voiced), len(voiced)))]:
+        timings += _spread(words[w0:w1], voiced, f0, p0)
+        w0, f0 = w1, p1
+    return timings
+
+def caption_timeline(hook_audio_path, body_audio_path, hook_duration, limit):
+    """Hook + body word timings on the final video's clock, cut at `limit` seconds."""
+    words = []
+    for path, offset in ((hook_audio_path, 0.0), (body_audio_path, hook_duration)):
+        for w in load_words(words_path(path)):
+            start = w["start"] + offset
+            if start < limit:
+                words.append({"word": w["word"], "start": start, "end": min(w["end"] + offset, limit)})
+    return words
+
+def caption_cues(words):
+    """[(start, end, chunk_words, active_index)]: one cue per word, grouped CAPTION_WORDS at a time.
+    A cue lasts until the next word in its chunk starts, so the caption doesn't flicker between words."""
+    cues = []
+    for i in range(0, len(words), CAPTION_WORDS):
+        chunk = words[i:i + CAPTION_WORDS]
+        texts = [w["word"] for w in chunk]
+        texts = tuple(texts)
+        for j, w in enumerate(chunk):
+            end = chunk[j + 1]["start"] if j + 1 < len(chunk) else w["end"]
+            cues.append((w["start"], max(end, w["start"] + 1.0 / FPS), texts, j))
+    return cues
+
+@functools.lru_cache(maxsize=256)
+def render_caption(texts, active, size=CAPTION_SIZE, fontsize=64, max_width=640):
+    """RGBA caption band: the chunk's words (a tuple) centered and wrapped, the active one in yellow.
+    Cached like text_layer(), so treat the result as read-only."""
+    font = load_font(CAPTION_FONT_FILE, fontsize)
+    space = font.getlength(" ")
+    texts = [t.upper() for t in texts]
+
+    lines, line = [], []
+    for i, word in enumerate(texts):
+        if line and font.getlength(" ".join(texts[k] for k in line + [i])) > max_width:
+            lines.append(line)
+            line = []
+        line.append(i)
+    if line:
+        lines.append(line)
+
+    layer = PIL.Image.new("RGBA", size, (0, 0, 0, 0))
+    draw = PIL.ImageDraw.Draw(layer)
+    line_h = fontsize * 1.15
+    y = size[1] / 2 - line_h * (len(lines) - 1) / 2
+    for line in lines:
+        x = (size[0] - font.getlength(" ".join(texts[k] for k in line))) / 2
+        for k in line:
+            draw.text((x, y), texts[k], font=font, anchor="lm", stroke_width=4, stroke_fill="black",
+                      fill=(255, 221, 0) if k == active else "white")
+            x += font.getlength(texts[k]) + space
+        y += line_h
+    return layer
+
+class CaptionFrames:
+    """Burned-in caption frames (RGBA). Frames are requested in order, so only the cue
+    currently on screen is kept rasterized."""
+
+    def __init__(self, words, duration, offset=0.0):
+        self.cues = [(s - offset, e - offset, texts, j) for s, e, texts, j in caption_cues(words)
+                     if e > offset and s < offset + duration]
+        self._starts = [c[0] for c in self.cues]
+        self._blank = np.zeros((CAPTION_SIZE[1], CAPTION_SIZE[0], 4), dtype=np.uint8)
+        self._cached = (None, self._blank)
+
+    def __call__(self, t):
+        i = bisect.bisect_right(self._starts, t) - 1
+        if i < 0 or t >= self.cues[i][1]:
+            return self._blank
+        if self._cached[0] != i:
+            _, _, texts, active = self.cues[i]
+            self._cached = (i, np.asarray(render_caption(texts, active)))
+        return self._cached[1]
+
+def caption_clip(words, duration, offset=0.0):
+    """CaptionFrames as a single clip with a mask."""
+    from moviepy.editor import VideoClip
+    frames = CaptionFrames(words, duration, offset)
+    clip = VideoClip(make_frame=lambda t: frames(t)[..., :3], duration=duration)
+    return clip.set_mask(VideoClip(make_frame=lambda t: frames(t)[..., 3] / 255.0, ismask=True, duration=duration))
+
+def write_caption_track(words, duration, directory):
+    """Cues as PNGs plus an ffconcat list (transparent gaps between them) for the ffmpeg backend."""
+    os.makedirs(directory, exist_ok=True)
+    blank = os.path.join(directory, "blank.png")
+    PIL.Image.new("RGBA", CAPTION_SIZE, (0, 0, 0, 0)).save(blank)
+
+    entries, t = [], 0.0
+    for i, (start, end, texts, active) in enumerate(caption_cues(words)):
+        start = max(start, t)
+        if end - start < 1.0 / FPS:
+            continue
+        if start - t >= 1.0 / FPS:
+            entries.append((blank, start - t))
+        png = os.path.join(directory, f"cue_{i:04d}.png")
+        render_caption(texts, active).save(png)
+        entries.append((png, end - start))
+        t = end
+    if duration > t:
+        entries.append((blank, duration - t))
+
+    track = os.path.join(directory, "captions.ffconcat")
+    with open(track, "w") as f:
+        f.write("ffconcat version 1.0\n")
+        for png, d in entries:
+            f.write(f"file '{os.path.abspath(png)}'\nduration {d:.3f}\n")
+        # The concat demuxer ignores the last entry's duration unless the file is repeated
+        f.write(f"file '{os.path.abspath(entries[-1][0])}'\n")
+    return track
+
+def _await_gradio(job, cancel=None):
+    """Wait for a gradio_client Job, cancelling it if the hedge race is lost."""
+    while not job.done():
+        if cancel is not None and cancel.wait(0.25):
+            job.cancel()
+            raise Cancelled("gradio job cancelled")
+        elif cancel is None:
+            time.sleep(0.25)
+    return job.result()
+
+def generate_audio_kokoro(text, filename, cancel=None):
+    print("   🎙️ Generating audio (Kokoro TTS)...")
+    try:
+        client = spaces.get(KOKORO_SPACE)
+        job = client.submit(
+            text=text,
+            model_path="kokoro-quant.onnx",
+            style_vector="am_adam.pt", # Male voice
+            output_file_format="mp3",
+            speed=1,
+            api_name="/local_tts"
+        )
+        result = _await_gradio(job, cancel)
+        shutil.copy(result, filename)
+        return filename
+    except Cancelled:
+        raise
+    except Exception as e:
+        print(f"   ⚠️ Kokoro Init Error: {e}")
+        spaces.invalidate(KOKORO_SPACE)
+        raise e
+
+async def _edge_stream(text, filename, words):
+    import edge_tts
+    communicate = edge_tts.Communicate(text, "en-US-ChristopherNeural", boundary="WordBoundary")
+    with open(filename, "wb") as f:
+        async for chunk in communicate.stream():
+            if chunk["type"] == "audio":
+                f.write(chunk["data"])
+            elif chunk["type"] == "WordBoundary":
+                # Offsets are in 100ns ticks
+                start = chunk["offset"] / 1e7
+                words.append({"word": chunk["text"], "start": round(start, 3),
+                              "end": round(start + chunk["duration"] / 1e7, 3)})
+
+def generate_audio_edge(text, filename, cancel=None, words=None):
+    """EdgeTTS, collecting its word boundary events into `words` as they stream in."""
+    asyncio.run(_edge_stream(text, filename, words if words is not None else []))
+    return filename
+
+# --- 4.7. LOCAL TTS (Kokoro ONNX In-Process) ---
+TTS_ENGINE = os.environ.get("TTS_ENGINE", "remote") # "remote" (Kokoro Space + EdgeTTS) or "local"
+TTS_PRIMARY = os.environ.get("TTS_PRIMARY", "kokoro") # Remote voice that leads the race; "edge" for exact word boundaries
+KOKORO_MODEL = os.environ.get("KOKORO_MODEL", "kokoro-v1.0.onnx")
+KOKORO_VOICES = os.environ.get("KOKORO_VOICES", "voices-v1.0.bin")
+
+def write_audio(samples, rate, path):
+    """Float samples in [-1, 1] -> 16-bit mono. .wav is written directly, anything else is encoded by ffmpeg from stdin."""
+    pcm = (np.clip(np.asarray(samples, dtype=np.float32), -1.0, 1.0) * 32767).astype("<i2").tobytes()
+    if path.lower().endswith(".wav"):
+        import wave
+        with wave.open(path, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(rate)
+            f.writeframes(pcm)
+    else:
+        run_ffmpeg(["-f", "s16le", "-ar", str(rate), "-ac", "1", "-i", "pipe:0", path], input=pcm)
+    return path
+
+class LocalTTS:
+    """The same Kokoro model the Space runs, on the CPU via onnxruntime (kokoro-onnx package).
+
+    The model is loaded once per process and every script (hook, body, every video in a
+    batch) is synthesized in that one session. Calls are serialized: onnxruntime already
+    spreads a single inference across all cores, so running two at once only thrashes.
+    """
+
+    def __init__(self, model_path=KOKORO_MODEL, voices_path=KOKORO_VOICES, voice="am_adam", speed=1.0):
+        self.model_path = model_path
+        self.voices_path = voices_path
+        self.voice = voice
+        self.speed = speed
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._run_lock = threading.Lock()
+
+    def load(self):
+        with self._load_lock:
+            if self._model is None:
+                from kokoro_onnx import Kokoro # Optional: only needed for TTS_ENGINE=local
+                start = time.time()
+                with tracer.span("tts.load_model", model=self.model_path):
+                    self._model = Kokoro(self.model_path, self.voices_path)
+                print(f"   🧠 Loaded local Kokoro model ({time.time() - start:.1f}s)")
+        return self._model
+
+    def synthesize(self, text, filename):
+        model = self.load()
+        with self._run_lock, tracer.span("tts.local", chars=len(text)):
+            if text.strip():
+                samples, rate = model.create(text, voice=self.voice, speed=self.speed, lang="en-us")
+            else:
+                samples, rate = np.zeros(2400, dtype=np.float32), 24000 # 0.1s of silence
+        return write_audio(samples, rate, filename)
+
+local_tts = LocalTTS()
+
+@tracer.traced("audio.tts")
+async def make_audio(text, filename):
+    edge_first = TTS_PRIMARY == "edge"
+    if TTS_ENGINE == "local":
+        cache_key = asset_cache.key("tts", f"kokoro-onnx:{local_tts.voice}", text, speed=local_tts.speed, timings="aligned")
+    else:
+        voices = ["kokoro:am_adam", "edge:en-US-ChristopherNeural"]
+        # Entries from before alignment carry text-estimated word timings, hence the timings field
+        cache_key = asset_cache.key("tts", "|".join(voices[::-1] if edge_first else voices), text, timings="aligned")
+    words_file = words_path(filename)
+    if asset_cache.fetch(cache_key, filename):
+        print(f"   ♻️ Cache hit: {filename}")
+        if not asset_cache.fetch(cache_key, words_file):
+            save_words(align_word_timings(text, filename), words_file)
+        return filename
+
+    loop = asyncio.get_running_loop()
+    timings = {}
+    if TTS_ENGINE == "local":
+        await loop.run_in_executor(None, local_tts.synthesize, text, filename)
+        print("   ✅ Local Kokoro TTS success.")
+        winner = "Local"
+    else:
+        # Kokoro first (unless TTS_PRIMARY=edge); the other joins the race if it is slow or fails
+        providers = [
+            ("Kokoro", lambda path, cancel: generate_audio_kokoro(text, path, cancel)),
+            ("EdgeTTS", lambda path, cancel: generate_audio_edge(text, path, cancel, timings.setdefault("EdgeTTS", []))),
+        ]
+        if edge_first:
+            providers.reverse()
+        try:
+            winner = await loop.run_in_executor(None, hedged_to_file, "TTS", providers, filename, TTS_HEDGE_AFTER)
+            print(f"   ✅ {winner} TTS success.")
+        except Exception as e:
+            print(f"   ❌ All TTS failed: {e}")
+            raise
+
+    # Only EdgeTTS reports word boundaries; Kokoro's are aligned to the voiced parts of its audio
+    words = timings.get(winner) or align_word_timings(text, filename)
+    save_words(words, words_file)
+    asset_cache.store(cache_key, filename)
+    asset_cache.store(cache_key, words_file)
+    return filename
+
+# --- 5. UPLOADER ---
+UPLOAD_CHUNK = 8 * 1024 * 1024 # Must be a multiple of 256 KB
+UPLOAD_MAX_RETRIES = 8
+RETRIABLE_STATUS = {500, 502, 503, 504}
+
+def youtube_client(creds):
+    """YouTube Data API service from the discovery document bundled with google-api-python-client,
+    so building it makes no network round trip and writes no discovery cache."""
+    from googleapiclient.discovery import build
+    return build("youtube", "v3", credentials=creds, static_discovery=True, cache_discovery=False)
+
+@tracer.traced("upload.youtube")
+def upload_to_youtube(video_path, title, description, tags):
+    from google.oauth2.credentials import Credentials
+    from googleapiclient.http import MediaFileUpload
+    from googleapiclient.errors import HttpError
+
+    if isinstance(tags, list):
+        tag_list = tags
+        tag_str = " ".join(tags)
+    else:
+        tag_list = tags.split(',')
+        tag_str = tags # Assuming it is already a string
+
+    # FORCE SHORTS METADATA
+    if "#Shorts" not in title:
         title = f"{title} #Shorts"
     if "#Shorts" not in description:
         description = f"{description}\n\n#Shorts"
 
     creds = Credentials(None, refresh_token=YT_REFRESH_TOKEN, token_uri="https://oauth2.googleapis.com/token", client_id=YT_CLIENT_ID, client_secret=YT_CLIENT_SECRET)
-    service = build("youtube", "v3", credentials=creds)
+    service = youtube_client(creds)
     body = {
         "snippet": {
             "title": title[:100], 
@@ -574,58 +2782,342 @@ def upload_to_youtube(video_path, title, description, tags):
         }, 
         "status": {"privacyStatus": "public"}
     }
-    media = MediaFileUpload(video_path, chunksize=-1, resumable=True)
-    res = service.videos().insert(part="snippet,status", body=body, media_body=media).execute()
-    return res['id']
+    media = MediaFileUpload(video_path, chunksize=UPLOAD_CHUNK, resumable=True)
+    request = service.videos().insert(part="snippet,status", body=body, media_body=media)
 
-# --- MAIN EXECUTION ---
-if __name__ == "__main__":
-    try:
-        # 1. BRAIN: Generate Viral Concept
+    # Resumable upload: after a failed chunk the client asks the server how much it
+    # has and continues from there, so only that chunk is re-sent.
+    response = None
+    failures = 0
+    sent = 0
+    while response is None:
+        try:
+            status, response = request.next_chunk()
+            failures = 0
+            if status:
+                tracer.count("bytes_out", status.resumable_progress - sent)
+                sent = status.resumable_progress
+                print(f"   ⬆️ YouTube upload: {int(status.progress() * 100)}%")
+        except HttpError as e:
+            if e.resp.status not in RETRIABLE_STATUS or failures >= UPLOAD_MAX_RETRIES:
+                raise
+            failures += 1
+            print(f"   ⚠️ Upload chunk failed ({e.resp.status}). Retry {failures}/{UPLOAD_MAX_RETRIES}...")
+        except (ConnectionError, TimeoutError, OSError) as e:
+            if failures >= UPLOAD_MAX_RETRIES:
+                raise
+            failures += 1
+            print(f"   ⚠️ Upload chunk failed ({e}). Retry {failures}/{UPLOAD_MAX_RETRIES}...")
+        if failures:
+            tracer.count("retries")
+            time.sleep(min(2 ** failures + random.random(), 30))
+
+    tracer.count("bytes_out", os.path.getsize(video_path) - sent)
+    print("   ⬆️ YouTube upload: 100%")
+    return response['id']
+
+# --- 6. SCHEDULER (Asset DAG) ---
+# Max in-flight jobs per remote provider. Everything else runs as "local".
+PROVIDER_LIMITS = {
+    "freepik": 3,
+    "wan": 1,
+    "tts": 2,
+    "local": os.cpu_count() or 2,
+}
+
+def provider_slots(limits=None):
+    limits = limits or PROVIDER_LIMITS
+    return {p: threading.Semaphore(n) for p, n in limits.items()}
+
+class AssetDAG:
+    """Dependency-graph scheduler: a job starts as soon as all of its deps
+    have finished, capped by a per-provider concurrency limit."""
+
+    def __init__(self, limits=None, slots=None):
+        self.limits = dict(PROVIDER_LIMITS)
+        self.limits.update(limits or {})
+        self.jobs = {}
+        # Pass the same slots to several DAGs to share provider limits between them (batch mode)
+        self._sems = slots if slots is not None else provider_slots(self.limits)
+
+    def add(self, name, fn, *args, provider="local", deps=(), **kwargs):
+        if provider not in self._sems:
+            self.limits[provider] = 1
+            self._sems[provider] = threading.Semaphore(1)
+        for d in deps:
+            if d not in self.jobs:
+                raise ValueError(f"Job '{name}' depends on unknown job '{d}'")
+        self.jobs[name] = (fn, args, kwargs, provider, tuple(deps))
+        return name
+
+    def _run_job(self, name):
+        fn, args, kwargs, provider, _ = self.jobs[name]
+        with self._sems[provider]:
+            if asyncio.iscoroutinefunction(fn):
+                # Each worker thread gets its own event loop
+                return asyncio.run(fn(*args, **kwargs))
+            return fn(*args, **kwargs)
+
+    def run(self, on_done=None):
+        """Run every job; on_done(name, result) is called as each one succeeds."""
+        results, errors = {}, {}
+        pending = list(self.jobs)
+        running = {}
+        workers = max(1, sum(self.limits.values()))
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while pending or running:
+                # Stop scheduling new work once something has failed
+                if not errors:
+                    for name in list(pending):
+                        if all(d in results for d in self.jobs[name][4]):
+                            running[pool.submit(self._run_job, name)] = name
+                            pending.remove(name)
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    name = running.pop(fut)
+                    try:
+                        results[name] = fut.result()
+                    except Exception as e:
+                        print(f"❌ Job '{name}' failed: {e}")
+                        errors[name] = e
+                        continue
+                    if on_done:
+                        on_done(name, results[name])
+
+        if errors:
+            raise next(iter(errors.values()))
+        return results
+
+# --- 7. RUNS (Checkpoint / Resume) ---
+RUNS_DIR = os.environ.get("RUNS_DIR", "runs")
+
+class PipelineRun:
+    """A run directory holding every stage's outputs plus manifest.json.
+    Stages recorded as done are skipped when the run is resumed."""
+
+    STAGES = ["concept", "plan", "images", "hook_animation", "audio", "edit", "captions", "upload"]
+
+    def __init__(self, run_id=None):
+        if run_id is None:
+            run_id = time.strftime("%Y%m%d-%H%M%S") + "-" + os.urandom(3).hex()
+        self.run_id = run_id
+        self.dir = os.path.join(RUNS_DIR, run_id)
+        self.manifest_path = os.path.join(self.dir, "manifest.json")
+        self._lock = threading.Lock()
+
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+        else:
+            os.makedirs(self.dir, exist_ok=True)
+            self.manifest = {"run_id": run_id, "created": time.time(), "status": "running", "stages": {}}
+            self._save()
+
+    @classmethod
+    def resume(cls, run_id):
+        if run_id == "latest":
+            runs = sorted(d for d in os.listdir(RUNS_DIR) if os.path.exists(os.path.join(RUNS_DIR, d, "manifest.json")))
+            if not runs:
+                raise FileNotFoundError(f"No runs found in {RUNS_DIR}/")
+            run_id = runs[-1]
+        if not os.path.exists(os.path.join(RUNS_DIR, run_id, "manifest.json")):
+            raise FileNotFoundError(f"No manifest for run '{run_id}'")
+        run = cls(run_id)
+        print(f"⏩ Resuming run {run_id} at stage: {run.next_stage()}")
+        return run
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def _save(self):
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp, self.manifest_path)
+
+    def _files(self, value):
+        if isinstance(value, str) and value.startswith(self.dir + os.sep):
+            yield value
+        elif isinstance(value, list):
+            for v in value:
+                yield from self._files(v)
+
+    def done(self, stage):
+        entry = self.manifest["stages"].get(stage)
+        if not entry or entry.get("status") != "done":
+            return False
+        # A stage only counts if the files it produced are still on disk
+        return all(os.path.exists(p) for v in entry["outputs"].values() for p in self._files(v))
+
+    def outputs(self, stage):
+        return self.manifest["stages"][stage]["outputs"]
+
+    def complete(self, stage, **outputs):
+        with self._lock:
+            self.manifest["stages"][stage] = {"status": "done", "finished": time.time(), "outputs": outputs}
+            self._save()
+
+    def next_stage(self):
+        return next((s for s in self.STAGES if not self.done(s)), None)
+
+    def finish(self, error=None):
+        with self._lock:
+            self.manifest["status"] = "failed" if error else "completed"
+            self.manifest["error"] = str(error) if error else None
+            self._save()
+
+# --- PIPELINE ---
+@tracer.traced("stage.concept")
+def stage_concept(run):
+    # 1. BRAIN: Generate Viral Concept
+    if run.done("concept"):
+        data = run.outputs("concept")["concept"]
+    else:
         data = get_concept()
-        print(f"📝 Title: {data['title']}")
-        print(f"🧠 Reaction: {data.get('target_reaction')} | Hook: {data.get('hook_text')}")
-        
-        # 2. ASSETS: Generate Content
-        # A. Hook Visual (Image -> Video)
-        generate_image_freepik(data.get('hook_visual', 'scary face'), "hook_base.jpg")
-        hook_video = animate_wan_i2v("hook_base.jpg", "terrifying movement, 4k", max_retries=2)
-        if not hook_video: hook_video = "hook_base.jpg" # Fallback to image if anim fails
-        
-        # B. Body Visuals (Images)
-        body_prompts = data.get('visual_prompts', [])
-        body_images = []
-        for i, p in enumerate(body_prompts):
-            fname = f"body_{i}.jpg"
-            generate_image_freepik(p, fname)
-            body_images.append(fname)
-            
-        # C. Audio (Split for Smart Sync)
+        run.complete("concept", concept=data)
+    print(f"📝 Title: {data['title']}")
+    print(f"🧠 Reaction: {data.get('target_reaction')} | Hook: {data.get('hook_text')}")
+    return data
+
+def add_audio_jobs(dag, run, data):
+    hook_audio = run.path("hook.mp3")
+    body_audio = run.path("body.mp3")
+    dag.add("hook_audio", make_audio, data.get('hook_audio', ''), hook_audio, provider="tts")
+    dag.add("body_audio", make_audio, data.get('script_body', ''), body_audio, provider="tts")
+    return hook_audio, body_audio
+
+def complete_audio(run, hook_audio, body_audio):
+    run.complete("audio", hook_audio=hook_audio, body_audio=body_audio,
+                 hook_words=words_path(hook_audio), body_words=words_path(body_audio))
+
+@tracer.traced("stage.plan")
+def stage_plan(run, data, slots=None):
+    # 1.5. PLAN: Budget body shots against the voiceover before any image is generated
+    if run.done("plan"):
+        return run.outputs("plan")
+    if SCENE_PLAN == "tts" and not run.done("audio"):
+        print("   🎙️ Generating Split Audio (for the scene plan)...")
+        dag = AssetDAG(slots=slots)
+        hook_audio, body_audio = add_audio_jobs(dag, run, data)
+        dag.run()
+        complete_audio(run, hook_audio, body_audio)
+
+    if run.done("audio"):
+        audio = run.outputs("audio")
+        source = "audio"
+        hook_duration = probe_duration(audio["hook_audio"])
+        body_duration = probe_duration(audio["body_audio"])
+    else:
+        source = "estimate"
+        hook_duration = estimate_speech_duration(data.get('hook_audio', ''))
+        body_duration = estimate_speech_duration(data.get('script_body', ''))
+
+    plan = plan_scenes(data.get('visual_prompts', []), hook_duration, body_duration)
+    run.complete("plan", source=source, **plan)
+    shot = f" of {plan['shots'][0]:.1f}s" if plan["shots"] else ""
+    print(f"🎬 Plan ({source}, {body_duration:.1f}s body): {len(plan['prompts'])} shots{shot}, {plan['dropped']} prompts dropped")
+    return plan
+
+@tracer.traced("stage.assets")
+def stage_assets(run, data, slots=None):
+    # 2. ASSETS: Generate Content
+    # All remote jobs go out at once; the DAG only serializes real dependencies.
+    dag = AssetDAG(slots=slots)
+    hook_image = run.path("hook_base.jpg")
+    if run.done("images"):
+        body_images = run.outputs("images")["body_images"]
+        prompts = []
+    else:
+        prompts = stage_plan(run, data, slots)["prompts"]
+        body_images = [run.path(f"body_{i}.jpg") for i in range(len(prompts))]
+    hook_audio = run.path("hook.mp3")
+    body_audio = run.path("body.mp3")
+    stage_jobs = {}
+
+    # A. Hook Visual (Image -> Video) + B. Body Visuals (Images, only the planned shots)
+    if not run.done("images"):
+        dag.add("hook_image", generate_image_freepik, data.get('hook_visual', 'scary face'), hook_image, provider="freepik")
+        for i, p in enumerate(prompts):
+            dag.add(f"body_{i}", generate_image_freepik, p, body_images[i], provider="freepik")
+        stage_jobs["images"] = ["hook_image"] + [f"body_{i}" for i in range(len(body_images))]
+
+    # Decode/resize each still on a local worker as soon as it lands, while remote jobs are still out.
+    # Each is prepared large enough for the deepest zoom its planned shot reaches.
+    hook_zoom = body_zoom = PREP_ZOOM
+    if run.done("plan"):
+        plan = run.outputs("plan")
+        slack = 1.25 if plan.get("source") == "estimate" else 1.0 # Estimated speech may run long
+        hook_zoom = ken_burns_zoom(plan["hook_duration"] * slack, 'zoom_in')
+        body_zoom = ken_burns_zoom(max(plan["shots"], default=0.0) * slack)
+    for name, path, zoom in [("hook_image", hook_image, hook_zoom)] + [(f"body_{i}", p, body_zoom) for i, p in enumerate(body_images)]:
+        if find_prepared(path, zoom) is None:
+            dag.add(f"prep_{name}", prepare_still, path, prep_size(zoom), provider="local", deps=[name] if name in dag.jobs else [])
+
+    if not run.done("hook_animation"):
+        deps = ["hook_image"] if "hook_image" in dag.jobs else []
+        dag.add("hook_video", animate_wan_i2v, hook_image, "terrifying movement, 4k", max_retries=2,
+                final_name=run.path("wan_climax.mp4"), budget=WAN_BUDGET, provider="wan", deps=deps)
+        # Started alongside Wan, so a moving hook is ready if Wan fails or runs out of budget
+        motion_deps = ["prep_hook_image"] if "prep_hook_image" in dag.jobs else deps
+        dag.add("hook_motion", procedural_hook, hook_image, run.path("hook_motion.mp4"), provider="local", deps=motion_deps)
+        stage_jobs["hook_animation"] = ["hook_video", "hook_motion"]
+
+    # C. Audio (Split for Smart Sync)
+    if not run.done("audio"):
         print("   🎙️ Generating Split Audio...")
-        hook_audio_text = data.get('hook_audio', '')
-        body_audio_text = data.get('script_body', '')
-        
-        async def generate_all_audio():
-            await asyncio.gather(
-                make_audio(hook_audio_text, "hook.mp3"),
-                make_audio(body_audio_text, "body.mp3")
-            )
-            
-        asyncio.run(generate_all_audio())
-        
-        # 3. EDIT: Assemble Viral Short
-        final_file = "viral_short.mp4"
-        create_viral_short(
-            hook_video_path=hook_video, 
-            body_image_paths=body_images, 
-            hook_audio_path="hook.mp3",
-            body_audio_path="body.mp3",
-            hook_text=data.get('hook_text', 'WAIT FOR IT'), 
-            output_filename=final_file
-        )
-        
-        # 4. CAPTIONS: Submagic -> Creatomate Fallback
-        
+        add_audio_jobs(dag, run, data)
+        stage_jobs["audio"] = ["hook_audio", "body_audio"]
+
+    # Checkpoint each stage the moment its last job lands
+    finished = {}
+    def on_done(name, result):
+        finished[name] = result
+        for stage, jobs in stage_jobs.items():
+            if name in jobs and all(j in finished for j in jobs):
+                if stage == "images":
+                    run.complete(stage, hook_image=hook_image, body_images=body_images)
+                elif stage == "hook_animation":
+                    run.complete(stage, hook_video=finished["hook_video"] or finished["hook_motion"])
+                elif stage == "audio":
+                    complete_audio(run, hook_audio, body_audio)
+
+    dag.run(on_done=on_done)
+    hook_video = run.outputs("hook_animation")["hook_video"]
+    if not hook_video: hook_video = hook_image # Fallback to image if anim fails
+    return {"hook_video": hook_video, "body_images": body_images, "hook_audio": hook_audio, "body_audio": body_audio}
+
+@tracer.traced("stage.edit")
+def stage_edit(run, data, assets):
+    # 3. EDIT: Assemble Viral Short
+    if run.done("edit"):
+        return run.outputs("edit")["video"]
+    final_file = run.path("viral_short.mp4")
+    profile = encode_profile()["name"]
+    create_viral_short(
+        hook_video_path=assets["hook_video"], 
+        body_image_paths=assets["body_images"], 
+        hook_audio_path=assets["hook_audio"],
+        body_audio_path=assets["body_audio"],
+        hook_text=data.get('hook_text', 'WAIT FOR IT'), 
+        output_filename=final_file,
+        profile=profile
+    )
+    run.complete("edit", video=final_file, profile=profile)
+    return final_file
+
+@tracer.traced("stage.publish")
+def stage_publish(run, data, final_file):
+    # 4. CAPTIONS: Submagic -> Creatomate Fallback
+    if run.done("captions"):
+        final_file = run.outputs("captions")["video"]
+    elif CAPTIONS == "local":
+        print("💬 Captions were burned in during the edit.")
+        run.complete("captions", video=final_file)
+    else:
         # Try Submagic first
         submagic = SubmagicClient()
         captioned_file = submagic.process_video(final_file, data['title'])
@@ -636,12 +3128,450 @@ if __name__ == "__main__":
              # Use Hook text or Title for overlay? User provided template suggesting text overlay.
              # We'll use the Hook Text as the primary overlay content.
              captioned_file = creatomate.process_video(final_file, data.get('hook_text', 'WATCH THIS'))
-             
+
+        if captioned_file == final_file and run.outputs("edit").get("profile", "draft") == "draft":
+            # Nothing re-encoded the draft intermediate; don't upload it as is
+            print("🎛️ Captioning skipped: re-encoding the draft edit with the final profile...")
+            captioned_file = reencode(final_file, run.path("viral_short.final.mp4"))
         final_file = captioned_file
-        
-        # 5. UPLOAD
+        run.complete("captions", video=final_file)
+    
+    # 5. UPLOAD
+    if run.done("upload"):
+        vid_id = run.outputs("upload")["video_id"]
+    else:
         vid_id = upload_to_youtube(final_file, data['title'], data['description'], data['hashtags'])
-        print(f"🚀 Published: https://youtube.com/shorts/{vid_id}")
+        run.complete("upload", video_id=vid_id)
+    print(f"🚀 Published: https://youtube.com/shorts/{vid_id}")
+    return vid_id
+
+def prewarm_assets():
+    """Space handshakes (and local model loads) overlap with the LLM call."""
+    if "local" in ANIMATION_BACKENDS:
+        _job_pool.submit(ANIMATORS["local"].start)
+    to_warm = [WAN_SPACE] if "space" in ANIMATION_BACKENDS else []
+    if TTS_ENGINE == "local":
+        _job_pool.submit(local_tts.load)
+    else:
+        to_warm.append(KOKORO_SPACE)
+    return spaces.prewarm(*to_warm)
+
+def run_pipeline(run):
+    if not (run.done("hook_animation") and run.done("audio")):
+        prewarm_assets()
+    data = stage_concept(run)
+    assets = stage_assets(run, data)
+    final_file = stage_edit(run, data, assets)
+    return stage_publish(run, data, final_file)
+
+# --- BATCH MODE ---
+def run_batch(count, asset_workers=3, edit_workers=1, publish_workers=2):
+    """Produce `count` shorts in one process. Each video moves through assets -> edit -> publish
+    on its own thread; per-stage semaphores bound how many videos are in each stage at once,
+    so remote waits for one video overlap with local rendering of another."""
+    prewarm_assets()
+    runs = []
+    for data in get_concept_pool().take_many(count):
+        run = PipelineRun()
+        run.complete("concept", concept=data)
+        runs.append(run)
+    print(f"📦 Batch: {len(runs)} runs queued ({', '.join(r.run_id for r in runs)})")
+
+    slots = provider_slots()
+    stage_limits = {
+        "assets": threading.Semaphore(asset_workers),
+        "edit": threading.Semaphore(edit_workers),
+        "publish": threading.Semaphore(publish_workers),
+    }
+
+    def produce(run):
+        data = run.outputs("concept")["concept"]
+        with stage_limits["assets"]:
+            assets = stage_assets(run, data, slots=slots)
+        with stage_limits["edit"]:
+            final_file = stage_edit(run, data, assets)
+        with stage_limits["publish"]:
+            return stage_publish(run, data, final_file)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=len(runs), thread_name_prefix="batch") as pool:
+        futures = {pool.submit(produce, run): run for run in runs}
+        for fut in futures:
+            run = futures[fut]
+            try:
+                results[run.run_id] = fut.result()
+                run.finish()
+            except Exception as e:
+                print(f"❌ Run {run.run_id} failed: {e}")
+                print(f"   Resume with: python main.py --resume {run.run_id}")
+                run.finish(error=e)
+                results[run.run_id] = None
+
+    published = sum(1 for v in results.values() if v)
+    print(f"📦 Batch done: {published}/{len(runs)} published")
+    tracer.write(RUNS_DIR, prefix=f"batch-{time.strftime('%Y%m%d-%H%M%S')}-trace")
+    return results
+
+# --- QUEUE MODE (Persistent Jobs + Provider Quotas) ---
+QUEUE_DB = os.environ.get("QUEUE_DB", os.path.join(RUNS_DIR, "queue.db"))
+QUEUE_MAX_ATTEMPTS = 3
+QUEUE_LEASE = float(os.environ.get("QUEUE_LEASE", "600")) # A running job not renewed for this long is presumed dead
+
+def parse_quota(key, default):
+    """"<requests>/<seconds>" from the environment -> (capacity, period)."""
+    tokens, period = os.environ.get(key, default).split("/")
+    return int(tokens), float(period)
+
+# Token buckets: `capacity` requests, refilled evenly over `period` seconds
+PROVIDER_QUOTAS = {
+    "groq": parse_quota("QUOTA_GROQ", "30/60"),
+    "freepik": parse_quota("QUOTA_FREEPIK", "100/3600"),
+    "submagic": parse_quota("QUOTA_SUBMAGIC", "500/3600"),
+    "youtube": parse_quota("QUOTA_YOUTUBE", "6/86400"), # 10,000 API units/day at 1,600 per upload
+}
+
+QUEUE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'queued',
+    not_before REAL NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, priority DESC, id);
+CREATE TABLE IF NOT EXISTS buckets (
+    provider TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+class JobQueue:
+    """SQLite-backed queue of shorts to produce, plus one token bucket per rate-limited
+    provider. Both live in the same file, so quotas carry over between cron invocations
+    and processes."""
+
+    def __init__(self, path=QUEUE_DB, quotas=None):
+        self.path = path
+        self.quotas = quotas or PROVIDER_QUOTAS
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        db = sqlite3.connect(path, timeout=30)
+        db.executescript(QUEUE_SCHEMA)
+        db.close()
+
+    @contextlib.contextmanager
+    def _tx(self):
+        """One write transaction; BEGIN IMMEDIATE serializes claims across threads and processes."""
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            yield db
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+
+    def enqueue(self, count=1, priority=0):
+        run_ids = []
+        for _ in range(count):
+            run = PipelineRun()
+            now = time.time()
+            with self._tx() as db:
+                db.execute("INSERT INTO jobs (run_id, priority, created, updated) VALUES (?, ?, ?, ?)",
+                           (run.run_id, priority, now, now))
+            run_ids.append(run.run_id)
+        return run_ids
+
+    def claim(self):
+        """Take the highest-priority ready job. Returns (job, None), or (None, seconds until
+        the next deferred job is ready), or (None, None) if nothing is queued."""
+        now = time.time()
+        with self._tx() as db:
+            job = db.execute("SELECT * FROM jobs WHERE status = 'queued' AND not_before <= ? "
+                             "ORDER BY priority DESC, id LIMIT 1", (now,)).fetchone()
+            if job is None:
+                row = db.execute("SELECT MIN(not_before) FROM jobs WHERE status = 'queued'").fetchone()
+                return None, (max(0.0, row[0] - now) if row[0] is not None else None)
+            db.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, updated = ? WHERE id = ?",
+                       (now, job["id"]))
+            return dict(job, status="running", attempts=job["attempts"] + 1, updated=now), None
+
+    def renew(self, job_ids):
+        """Extend the lease on jobs this process is still working on."""
+        if not job_ids:
+            return
+        now = time.time()
+        with self._tx() as db:
+            db.executemany("UPDATE jobs SET updated = ? WHERE id = ? AND status = 'running'",
+                           [(now, job_id) for job_id in job_ids])
+
+    def defer(self, job_id, seconds):
+        """Put a job back until a quota refills. Waiting on a quota isn't a failed attempt."""
+        now = time.time()
+        with self._tx() as db:
+            db.execute("UPDATE jobs SET status = 'queued', not_before = ?, attempts = attempts - 1, updated = ? "
+                       "WHERE id = ?", (now + seconds, now, job_id))
+
+    def complete(self, job_id):
+        with self._tx() as db:
+            db.execute("UPDATE jobs SET status = 'done', error = NULL, updated = ? WHERE id = ?", (time.time(), job_id))
+
+    def fail(self, job_id, error):
+        """Retry with backoff until QUEUE_MAX_ATTEMPTS, then mark failed. Returns True if requeued."""
+        now = time.time()
+        with self._tx() as db:
+            attempts = db.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+            retry = attempts < QUEUE_MAX_ATTEMPTS
+            db.execute("UPDATE jobs SET status = ?, not_before = ?, error = ?, updated = ? WHERE id = ?",
+                       ("queued" if retry else "failed", now + 300 * attempts, str(error), now, job_id))
+        return retry
+
+    def reset_stale(self, lease=None):
+        """Jobs left 'running' by a killed drain go back to the queue. A job counts as abandoned
+        once its lease (renewed while a drain works on it) has run out, so a drain that
+        overlaps a live one leaves that one's jobs alone."""
+        lease = QUEUE_LEASE if lease is None else lease
+        now = time.time()
+        with self._tx() as db:
+            n = db.execute("UPDATE jobs SET status = 'queued', attempts = MAX(0, attempts - 1), updated = ? "
+                           "WHERE status = 'running' AND updated < ?", (now, now - lease)).rowcount
+        if n:
+            print(f"📥 Requeued {n} interrupted job(s)")
+
+    def take(self, needs):
+        """Consume tokens for every provider in `needs` ({provider: count}) atomically.
+        Returns 0 on success, else seconds until all of them are available (nothing is taken)."""
+        needs = {p: n for p, n in needs.items() if n and p in self.quotas}
+        if not needs:
+            return 0
+        now = time.time()
+        with self._tx() as db:
+            levels, wait_s = {}, 0.0
+            for provider, n in needs.items():
+                capacity, period = self.quotas[provider]
+                rate = capacity / period
+                row = db.execute("SELECT tokens, updated FROM buckets WHERE provider = ?", (provider,)).fetchone()
+                tokens = capacity if row is None else min(capacity, row["tokens"] + (now - row["updated"]) * rate)
+                n = min(n, capacity) # A request bigger than the bucket waits for a full one
+                levels[provider] = tokens - n
+                if tokens < n:
+                    wait_s = max(wait_s, (n - tokens) / rate)
+            if wait_s:
+                return wait_s
+            for provider, tokens in levels.items():
+                db.execute("INSERT OR REPLACE INTO buckets (provider, tokens, updated) VALUES (?, ?, ?)",
+                           (provider, tokens, now))
+        return 0
+
+    def report(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        counts = dict(db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        buckets = {p: (t, u) for p, t, u in db.execute("SELECT provider, tokens, updated FROM buckets")}
+        db.close()
+        lines = ["📥 Queue: " + (", ".join(f"{n} {status}" for status, n in sorted(counts.items())) or "empty")]
+        now = time.time()
+        for provider, (capacity, period) in self.quotas.items():
+            tokens, updated = buckets.get(provider, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * capacity / period)
+            lines.append(f"   {provider:<10} {tokens:6.1f}/{capacity} requests per {period:g}s")
+        return "\n".join(lines)
+
+def run_queued(queue, run):
+    """Advance one run as far as provider quotas allow. Returns 0 once published, else the
+    seconds until the quota for its next stage refills (completed stages are checkpointed)."""
+    if not run.done("concept") and not get_concept_pool().available():
+        wait_s = queue.take({"groq": 1})
+        if wait_s:
+            return wait_s
+    data = stage_concept(run)
+
+    if not run.done("images"):
+        wait_s = queue.take({"freepik": 1 + len(stage_plan(run, data)["prompts"])})
+        if wait_s:
+            return wait_s
+    assets = stage_assets(run, data)
+    final_file = stage_edit(run, data, assets)
+
+    needs = {}
+    if CAPTIONS != "local" and not run.done("captions"):
+        needs["submagic"] = 1
+    if not run.done("upload"):
+        needs["youtube"] = 1
+    wait_s = queue.take(needs)
+    if wait_s:
+        return wait_s
+    stage_publish(run, data, final_file)
+    return 0
+
+def drain_queue(queue, workers=1, max_wait=900):
+    """Work through the queue on `workers` threads as fast as quotas permit. Exits once
+    nothing is queued, or the next job can't start within max_wait seconds (the next
+    cron invocation picks it up)."""
+    queue.reset_stale()
+    prewarm_assets()
+    done = []
+    held = set()
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(QUEUE_LEASE / 4):
+            try:
+                queue.renew(list(held))
+            except sqlite3.Error as e:
+                print(f"   ⚠️ Could not renew queue leases: {e}")
+
+    def worker():
+        while True:
+            job, wait_s = queue.claim()
+            if job is None:
+                if wait_s is None or wait_s > max_wait:
+                    return
+                time.sleep(min(wait_s, 30) + 0.1)
+                continue
+
+            run = PipelineRun(job["run_id"])
+            print(f"📥 Job {job['id']} (run {run.run_id}, priority {job['priority']}) at stage: {run.next_stage()}")
+            held.add(job["id"])
+            try:
+                wait_s = run_queued(queue, run)
+            except Exception as e:
+                print(f"❌ Job {job['id']} failed: {e}")
+                run.finish(error=e)
+                if queue.fail(job["id"], e):
+                    print(f"   Retrying later (attempt {job['attempts']}/{QUEUE_MAX_ATTEMPTS})")
+                continue
+            finally:
+                held.discard(job["id"])
+            if wait_s:
+                print(f"   ⏳ Quota exhausted; job {job['id']} deferred {wait_s:.0f}s")
+                queue.defer(job["id"], wait_s)
+            else:
+                run.finish()
+                queue.complete(job["id"])
+                done.append(run.run_id)
+
+    threads = [threading.Thread(target=worker, name=f"queue-{i}") for i in range(max(1, workers))]
+    beat = threading.Thread(target=heartbeat, name="queue-lease", daemon=True)
+    beat.start()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stop.set()
+
+    print(f"📥 Drained: {len(done)} published")
+    print(queue.report())
+    tracer.write(RUNS_DIR, prefix=f"queue-{time.strftime('%Y%m%d-%H%M%S')}-trace")
+    return done
+
+# --- IMPORT REPORT ---
+_IMPORT_DONE = time.perf_counter()
+# Imported on first use by the stage that needs them (listed in pipeline order)
+LAZY_MODULES = ["groq", "gradio_client", "edge_tts", "kokoro_onnx", "diffusers", "moviepy.editor", "googleapiclient.discovery"]
+
+def import_report(modules=LAZY_MODULES):
+    """Startup cost of main.py itself, then what each lazily imported module adds when its
+    stage first runs. Timings are incremental: shared dependencies are charged to the
+    first module that pulls them in."""
+    lines = [f"⏱️ main.py imported in {_IMPORT_DONE - _IMPORT_START:.3f}s ({len(sys.modules)} modules loaded)"]
+    for name in modules:
+        if name in sys.modules:
+            lines.append(f"   {name:<28} already loaded")
+            continue
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            lines.append(f"   {name:<28} not installed")
+            continue
+        lines.append(f"   {name:<28} +{time.perf_counter() - start:.3f}s")
+    return "\n".join(lines)
+
+# --- MAIN EXECUTION ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cursed Archives viral short generator")
+    parser.add_argument("--resume", metavar="RUN_ID", help="Continue a previous run from its first incomplete stage ('latest' for the newest)")
+    parser.add_argument("--render-backend", choices=["moviepy", "ffmpeg"], help="Video render engine (default: $RENDER_BACKEND or moviepy)")
+    parser.add_argument("--render-workers", type=int, help="moviepy backend: encode segments on N processes (default: $RENDER_WORKERS or 1)")
+    parser.add_argument("--tts-engine", choices=["remote", "local"], help="remote: Kokoro Space + EdgeTTS; local: Kokoro ONNX on this machine (default: $TTS_ENGINE or remote)")
+    parser.add_argument("--captions", choices=["local", "submagic"], help="local: burn in from TTS word timings; submagic: Submagic -> Creatomate (default: $CAPTIONS or local)")
+    parser.add_argument("--encode-profile", choices=["auto"] + list(ENCODE_PROFILES), help="x264 profile for the edit (default: $ENCODE_PROFILE or auto)")
+    parser.add_argument("--scene-plan", choices=["estimate", "tts"], help="Size the body shot list from a script-length estimate, or synthesize the audio first (default: $SCENE_PLAN or estimate)")
+    parser.add_argument("--audio-bed", metavar="BED", help="Mix a bed under the voiceover: 'drone' or an audio file to loop (default: $AUDIO_BED or none)")
+    parser.add_argument("--loudness", type=float, metavar="LUFS", help="Integrated loudness target of the mix (default: $LOUDNESS_TARGET or -14)")
+    parser.add_argument("--encode-threads", type=int, help="x264 threads (default: $ENCODE_THREADS or automatic)")
+    parser.add_argument("--animation-backend", help="Comma-separated Wan backends to try in order: space, local (default: $ANIMATION_BACKEND or space)")
+    parser.add_argument("--wan-quality", choices=list(WAN_SETTINGS), help="Wan steps/resolution/length (default: $WAN_QUALITY or full)")
+    parser.add_argument("--batch", type=int, metavar="N", help="Produce N shorts in this process")
+    parser.add_argument("--asset-workers", type=int, default=3, help="Batch: videos generating assets at once")
+    parser.add_argument("--edit-workers", type=int, default=1, help="Batch: videos rendering at once")
+    parser.add_argument("--publish-workers", type=int, default=2, help="Batch: videos captioning/uploading at once")
+    parser.add_argument("--enqueue", type=int, metavar="N", help="Add N shorts to the persistent job queue ($QUEUE_DB)")
+    parser.add_argument("--priority", type=int, default=0, help="Queue: priority of enqueued jobs (higher runs first)")
+    parser.add_argument("--drain", action="store_true", help="Queue: produce queued shorts as fast as provider quotas allow")
+    parser.add_argument("--queue-workers", type=int, default=1, help="Queue: shorts in flight at once while draining")
+    parser.add_argument("--max-wait", type=float, default=900, help="Queue: stop draining when the next job is further away than this (s)")
+    parser.add_argument("--queue-status", action="store_true", help="Queue: print job counts and quota levels")
+    parser.add_argument("--import-report", action="store_true", help="Print startup time and the cost of each lazily imported module, then exit")
+    args = parser.parse_args()
+    if args.import_report:
+        print(import_report())
+        sys.exit(0)
+    if args.render_backend:
+        RENDER_BACKEND = args.render_backend
+    if args.render_workers:
+        RENDER_WORKERS = args.render_workers
+    if args.tts_engine:
+        TTS_ENGINE = args.tts_engine
+    if args.captions:
+        CAPTIONS = args.captions
+    if args.encode_profile:
+        ENCODE_PROFILE = args.encode_profile
+    if args.encode_threads:
+        ENCODE_THREADS = args.encode_threads
+    if args.scene_plan:
+        SCENE_PLAN = args.scene_plan
+    if args.audio_bed:
+        AUDIO_BED = args.audio_bed
+    if args.loudness is not None:
+        LOUDNESS_TARGET = args.loudness
+    if args.animation_backend:
+        ANIMATION_BACKENDS = [b.strip() for b in args.animation_backend.split(",") if b.strip()]
+    if args.wan_quality:
+        WAN_QUALITY = args.wan_quality
+
+    run = None
+    try:
+        if args.enqueue or args.drain or args.queue_status:
+            queue = JobQueue()
+            if args.enqueue:
+                print(f"📥 Enqueued: {', '.join(queue.enqueue(args.enqueue, args.priority))}")
+            if args.drain:
+                drain_queue(queue, args.queue_workers, args.max_wait)
+            elif args.queue_status:
+                print(queue.report())
+        elif args.batch:
+            run_batch(args.batch, args.asset_workers, args.edit_workers, args.publish_workers)
+        else:
+            run = PipelineRun.resume(args.resume) if args.resume else PipelineRun()
+            print(f"🗂️ Run ID: {run.run_id}")
+            run_pipeline(run)
+            run.finish()
         
     except Exception as e:
         print(f"❌ Critical Failure: {e}")
+        if run:
+            run.finish(error=e)
+            print(f"   Resume with: python main.py --resume {run.run_id}")
+    finally:
+        if run:
+            tracer.write(run.dir)
+        print(tracer.report())
+        print(asset_cache.report())